@@ -0,0 +1,112 @@
+"""Reports memory used per AST node and per parsed TOC file, measured with tracemalloc on a synthetic TOC written to disk.
+
+Usage: python benchmarks/bench_memory.py [--files 5000]
+"""
+
+import sys
+import argparse
+import tempfile
+import tracemalloc
+
+from pathlib import Path
+
+from pytoc import *
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from bench_parser import make_synthetic_toc  # noqa: E402
+
+
+def measure(func, *args) -> tuple[int, object]:
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        used, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return used, result
+
+
+def shallow_size(obj) -> int:
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+
+    return size
+
+
+def load_toc(path: Path, header_only: bool = False, materialize_files: bool = False, from_source: bool = False) -> TOCFile:
+    if from_source:
+        with open(path, encoding="utf-8") as f:
+            toc = TOCFile.from_source(f.read(), path)
+    else:
+        toc = TOCFile(path, header_only=header_only)
+
+    if materialize_files:
+        toc.load_files()
+
+    return toc
+
+
+# every measurement starts from the path on disk, so reading the file is counted the same way for each of them
+
+
+def load_ast_from_stream(path: Path) -> TOCAST:
+    with open(path, encoding="utf-8") as f:
+        return TOCAST.from_stream(f)
+
+
+def load_ast_from_source(path: Path) -> TOCAST:
+    with open(path, encoding="utf-8") as f:
+        return TOCAST.from_source(f.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000, help="number of file lines in the synthetic TOC")
+    args = parser.parse_args()
+
+    text = "".join(make_synthetic_toc(args.files))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "Synthetic.toc"
+        path.write_text(text, encoding="utf-8")
+
+        print(f"synthetic TOC: {len(text.splitlines())} lines, {path.stat().st_size} bytes\n")
+
+        print("bytes per node (shallow, including __dict__ if any)")
+        ast = load_ast_from_stream(path)
+        seen = set()
+        for node in ast.Lines:
+            for obj in (node, getattr(node, "Value", None), getattr(node, "FileEntry", None)):
+                if obj is None or type(obj) in seen or isinstance(obj, str):
+                    continue
+
+                seen.add(type(obj))
+                print(f"  {type(obj).__name__:<28}{shallow_size(obj):>8}")
+
+        print("\nbytes per node (deep, averaged over the AST, file read included)")
+        for name, func in (
+            ("TOCAST.from_stream", load_ast_from_stream),
+            ("TOCAST.from_source", load_ast_from_source),
+        ):
+            used, result = measure(func, path)
+            print(f"  {name:<28}{used / len(result.Lines):>8.1f}")
+
+        print("\nbytes per parsed TOC")
+        for name, kwargs in (
+            ("TOCFile (header only)", {"header_only": True}),
+            ("TOCFile (lazy files)", {}),
+            ("TOCFile (files parsed)", {"materialize_files": True}),
+            ("TOCFile.from_source", {"from_source": True}),
+            ("TOCFile.from_source (parsed)", {"from_source": True, "materialize_files": True}),
+        ):
+            used, _ = measure(lambda: load_toc(path, **kwargs))
+            print(f"  {name:<28}{used:>12,}")
+
+        used, _ = measure(TOCColumnarAST.from_file, path)
+        print(f"  {'TOCColumnarAST':<28}{used:>12,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Measures line classification throughput on large synthetic TOC files.
+
+Compares the old is_empty / is_directive / is_comment chain (plus the string splits done by parse_directive_line)
+against the single-pass tokenizer in pytoc.parser, and reports end-to-end TOCAST.from_lines throughput.
+Both classifiers split out and resolve the directive name and locale, so they do the same work.
+
+Usage: python benchmarks/bench_parser.py [--files 20000] [--repeat 20]
+"""
+
+import time
+import random
+import argparse
+
+from pytoc import *
+
+DIRECTIVE_LINES = [
+    "## Interface: 110000, 110105, 11507, 30404, 40402, 50500\n",
+    "## Title: Synthetic\n",
+    "## Title-frFR: Synthétique\n",
+    "## Title-deDE: Synthetisch\n",
+    "## Notes: A generated addon used for benchmarking.\n",
+    "## Author: pytoc\n",
+    "## Version: 1.0.0\n",
+    "## SavedVariables: SyntheticDB, SyntheticConfig\n",
+    "## Dependencies: LibStub, CallbackHandler-1.0\n",
+    "## OptionalDeps: Ace3\n",
+    "## X-Website: https://example.com\n",
+    "## X-Curse-Project-ID: 12345\n",
+    "## X-Category-enUS: Bags\n",
+    "## Vendor-Directive: some value\n",
+]
+
+
+def make_synthetic_toc(num_files: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    lines = list(DIRECTIVE_LINES)
+    lines.append("\n")
+
+    for i in range(num_files):
+        roll = rng.random()
+        if roll < 0.05:
+            lines.append(f"# section {i}\n")
+        elif roll < 0.10:
+            lines.append("\n")
+        elif roll < 0.20:
+            lines.append(f"[Family]/Module{i}/Module{i}.lua [AllowLoadGameType mainline, classic]\n")
+        else:
+            lines.append(f"Modules/Module{i}/Module{i}.lua\n")
+
+    return lines
+
+
+def legacy_classify(line: str):
+    if is_empty(line):
+        return TOCLineKind.Empty, None
+    elif is_directive(line):
+        name, value = line.split(": ", 1)
+        name = name.split(" ", 1)[1]
+        return TOCLineKind.Directive, (name, resolve_directive_name_and_locale(name), value)
+    elif is_comment(line):
+        return TOCLineKind.Comment, None
+
+    return TOCLineKind.FileEntry, None
+
+
+def tokenizer_classify(line: str):
+    kind, match = tokenize_line(line)
+    if kind is TOCLineKind.Directive:
+        name, base, locale, value = match.group("raw", "name", "locale", "value")
+        if locale is not None and locale not in TEXT_LOCALES:
+            base, locale = name, None
+
+        return kind, (name, (TOC_DIRECTIVE_REGISTRY.resolve(base)[0], locale), value)
+
+    return kind, None
+
+
+def time_once(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def best_of(repeat: int, func, *args) -> float:
+    return min(time_once(func, *args) for _ in range(repeat))
+
+
+def run_classifier(classify, lines: list[str]):
+    for line in lines:
+        classify(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20000, help="number of file lines in the synthetic TOC")
+    parser.add_argument("--repeat", type=int, default=20, help="number of timed runs, the best one is reported")
+    args = parser.parse_args()
+
+    lines = make_synthetic_toc(args.files)
+    num_lines = len(lines)
+
+    # runs are interleaved, so noise from the rest of the machine hits both classifiers alike
+    legacy = tokenizer = float("inf")
+    for _ in range(args.repeat):
+        legacy = min(legacy, time_once(run_classifier, legacy_classify, lines))
+        tokenizer = min(tokenizer, time_once(run_classifier, tokenizer_classify, lines))
+
+    full = best_of(args.repeat, TOCAST.from_lines, lines)
+
+    print(f"synthetic TOC: {num_lines} lines")
+    print(f"{'classifier (before)':<24}{num_lines / legacy:>14,.0f} lines/sec")
+    print(f"{'classifier (after)':<24}{num_lines / tokenizer:>14,.0f} lines/sec  ({legacy / tokenizer:.2f}x)")
+    print(f"{'TOCAST.from_lines':<24}{num_lines / full:>14,.0f} lines/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Times scan_addons over a synthetic AddOns folder, in this process, in process pools and with a TOCParseCache.
+
+Wall time is what a caller waits for. Parent CPU time is what the scanning process itself spends, which is what a pool can't spread out:
+if it gets close to the serial wall time, more workers won't help.
+
+Usage: python benchmarks/bench_scan.py [--addons 500] [--files 200] [--jobs 1 2 4] [--repeat 3]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+from pathlib import Path
+
+from pytoc import *
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from bench_parser import make_synthetic_toc  # noqa: E402
+
+
+def make_addons(root: Path, num_addons: int, num_files: int):
+    for i in range(num_addons):
+        folder = root / f"Addon{i}"
+        folder.mkdir()
+        (folder / f"Addon{i}.toc").write_text("".join(make_synthetic_toc(num_files, seed=i)), encoding="utf-8")
+
+
+def time_scan(root: Path, jobs: int, **kwargs) -> tuple[float, float, TOCCorpus]:
+    wall, cpu = time.perf_counter(), time.process_time()
+    corpus = scan_addons(root, jobs=jobs, **kwargs)
+    return time.perf_counter() - wall, time.process_time() - cpu, corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--addons", type=int, default=500, help="number of addon folders")
+    parser.add_argument("--files", type=int, default=200, help="number of file lines in each synthetic TOC")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, max(2, os.cpu_count() or 1)], help="pool sizes to compare")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        make_addons(root, args.addons, args.files)
+        print(f"{args.addons} addons, {args.files} file lines each, {os.cpu_count()} cpus")
+
+        serial = None
+        for jobs in dict.fromkeys(args.jobs):
+            wall, cpu = min(time_scan(root, jobs)[:2] for _ in range(args.repeat))
+            serial = serial or wall
+            print(f"{f'jobs={jobs}':<26}{wall:>8.3f}s wall {cpu:>8.3f}s parent cpu  ({serial / wall:.2f}x)")
+
+        with tempfile.TemporaryDirectory() as cache_dir, TOCParseCache(cache_dir) as cache:
+            for name in ("jobs=1, cold cache", "jobs=1, warm cache"):
+                wall, cpu, corpus = time_scan(root, 1, cache=cache)
+                print(f"{name:<26}{wall:>8.3f}s wall {cpu:>8.3f}s parent cpu  ({serial / wall:.2f}x)")
+
+        for name, read in (("TOCFile.Title", lambda toc: toc.Title), ("TOCFile.Files", lambda toc: toc.Files)):
+            corpus = time_scan(root, 1)[2]
+            start = time.perf_counter()
+            for addon_file in corpus.iter_files():
+                read(addon_file.TOC)
+            print(f"{name + ' (on access)':<26}{time.perf_counter() - start:>8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,4 @@
 from pytoc.toc import *
+from pytoc.cache import *
+from pytoc.corpus import *
+from pytoc.watcher import *
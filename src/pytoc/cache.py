@@ -0,0 +1,194 @@
+import os
+import time
+import pickle
+import sqlite3
+
+from pathlib import Path
+from typing import Union, Optional, Any
+from importlib.metadata import version, PackageNotFoundError
+
+from .parser import TOCColumnarAST
+from .toc import TOCFile
+
+# bump this whenever a change to TOCColumnarAST or TOCSource would make old pickles load wrong
+PYTOC_CACHE_FORMAT_VERSION = 3
+
+try:
+    _PACKAGE_VERSION = version("wow-pytoc")
+except PackageNotFoundError:
+    _PACKAGE_VERSION = "dev"
+
+CACHE_FORMAT = f"{PYTOC_CACHE_FORMAT_VERSION}:{_PACKAGE_VERSION}"
+
+CACHE_FILE_NAME = "pytoc-cache.sqlite3"
+CACHE_DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+CACHE_EVICTION_TARGET = 0.9  # once over the size limit, the least recently used entries are evicted until the cache is down to this fraction of it
+CACHE_COMMIT_EVERY = 256
+
+CACHE_KIND_COLUMNAR = "columnar"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    data BLOB NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (path, kind)
+)
+"""
+
+
+class TOCParseCache:
+    """An on-disk cache of parsed TOC files, stored in a single SQLite file.
+
+    Files are cached as a TOCColumnarAST, which is little more than the file's text and unpickles far faster than it's parsed.
+    A TOCFile is built from it with TOCFile.from_columnar, only parsing its directives up front.
+
+    Entries are keyed by path and validated against the file's size, mtime and the pytoc cache format, so a changed file or a pytoc update is a cache miss.
+    Once the cache grows past `max_bytes`, the least recently used entries are evicted.
+
+    Writes are committed in batches, use the cache as a context manager (or call close()) to make sure everything is written."""
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = CACHE_DEFAULT_MAX_BYTES):
+        path = Path(path)
+        if path.is_dir() or not path.suffix:
+            path.mkdir(parents=True, exist_ok=True)
+            path = path / CACHE_FILE_NAME
+
+        self.Path = path
+        self.MaxBytes = max_bytes
+        self.Hits = 0
+        self.Misses = 0
+
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(_SCHEMA)
+        self._connection.commit()
+
+        self._size = self._connection.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM entries").fetchone()[0]
+        self._touched: list[tuple[int, str, str]] = []
+        self._pending = 0
+
+    def __enter__(self) -> "TOCParseCache":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @property
+    def Size(self) -> int:
+        """The total size of the cached data, in bytes"""
+        return self._size
+
+    @staticmethod
+    def _key(path: Union[str, Path]) -> str:
+        return os.path.abspath(path)
+
+    def get(self, path: Union[str, Path], kind: str, stat: Optional[os.stat_result] = None) -> Optional[Any]:
+        """Returns the cached object of the given kind for `path`, or None if there isn't one, the file changed since it was cached or the entry can't be read"""
+        key = self._key(path)
+        if stat is None:
+            stat = os.stat(path)
+
+        row = self._connection.execute("SELECT size, mtime_ns, format, data FROM entries WHERE path = ? AND kind = ?", (key, kind)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns or row[2] != CACHE_FORMAT:
+            self.Misses += 1
+            return None
+
+        try:
+            value = pickle.loads(row[3])
+        except Exception:
+            # a truncated or otherwise broken entry is a miss, and is dropped so the next put replaces it
+            self.Misses += 1
+            self._connection.execute("DELETE FROM entries WHERE path = ? AND kind = ?", (key, kind))
+            self._size -= len(row[3])
+            return None
+
+        self.Hits += 1
+        self._touched.append((time.time_ns(), key, kind))
+        return value
+
+    def put(self, path: Union[str, Path], kind: str, value: Any, stat: Optional[os.stat_result] = None):
+        """Caches `value` for `path`. `stat` should be taken before the file was read, so a file changed while it was read isn't cached as the new version."""
+        key = self._key(path)
+        if stat is None:
+            stat = os.stat(path)
+
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        old = self._connection.execute("SELECT LENGTH(data) FROM entries WHERE path = ? AND kind = ?", (key, kind)).fetchone()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO entries (path, kind, size, mtime_ns, format, data, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, kind, stat.st_size, stat.st_mtime_ns, CACHE_FORMAT, data, time.time_ns()),
+        )
+        self._size += len(data) - (old[0] if old is not None else 0)
+
+        if self._size > self.MaxBytes:
+            self.evict()
+
+        self._pending += 1
+        if self._pending >= CACHE_COMMIT_EVERY:
+            self.flush()
+
+    def load_toc(self, path: Union[str, Path]) -> TOCFile:
+        """Same as TOCFile(path), but built from the cached columnar AST when the file hasn't changed, see TOCFile.from_columnar"""
+        return TOCFile.from_columnar(self.load_columnar(path), path)
+
+    def load_columnar(self, path: Union[str, Path]) -> TOCColumnarAST:
+        """Same as TOCColumnarAST.from_file(path), but served from the cache when the file hasn't changed"""
+        stat = os.stat(path)
+        ast = self.get(path, CACHE_KIND_COLUMNAR, stat)
+        if ast is None:
+            ast = TOCColumnarAST.from_file(path)
+            self.put(path, CACHE_KIND_COLUMNAR, ast, stat)
+
+        return ast
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is back under its size limit"""
+        self._flush_touched()
+        target = int(self.MaxBytes * CACHE_EVICTION_TARGET)
+        evicted = []
+        for key, kind, size in self._connection.execute("SELECT path, kind, LENGTH(data) FROM entries ORDER BY last_used"):
+            if self._size <= target:
+                break
+
+            evicted.append((key, kind))
+            self._size -= size
+
+        self._connection.executemany("DELETE FROM entries WHERE path = ? AND kind = ?", evicted)
+
+    def remove(self, path: Union[str, Path]):
+        """Removes every entry for `path`"""
+        key = self._key(path)
+        removed = self._connection.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM entries WHERE path = ?", (key,)).fetchone()[0]
+        self._connection.execute("DELETE FROM entries WHERE path = ?", (key,))
+        self._size -= removed
+
+    def clear(self):
+        self._touched.clear()
+        self._connection.execute("DELETE FROM entries")
+        self._connection.commit()
+        self._size = 0
+
+    def _flush_touched(self):
+        # last_used is only updated in bulk, so hits don't each cost a write
+        if self._touched:
+            self._connection.executemany("UPDATE entries SET last_used = ? WHERE path = ? AND kind = ?", self._touched)
+            self._touched.clear()
+
+    def flush(self):
+        """Commits every pending write"""
+        self._flush_touched()
+        self._connection.commit()
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._connection.close()
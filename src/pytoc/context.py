@@ -1,8 +1,53 @@
+from typing import Optional
 from dataclasses import dataclass, field
 
 from .enums import *
 
 
+@dataclass(frozen=True, slots=True)
+class TOCContextKey:
+	"""The immutable part of an evaluation context, usable as a dict key. Get instances through TOCContextKey.get(), which interns them.
+
+	Keys can be passed anywhere a context is only used for its game type, environment and text locale, like load conditions and load plans."""
+
+	GameType: TOCGameType
+	Environment: TOCEnvironment
+	TextLocale: TOCTextLocale
+	Family: Optional[TOCFamily] = field(init=False, compare=False, repr=False)  # None for unknown game types
+
+	def __post_init__(self):
+		object.__setattr__(self, "Family", TOC_GAME_TYPE_TO_FAMILY.get(self.GameType))
+
+	def __reduce__(self):
+		# unpickled keys are interned too
+		return (TOCContextKey.get, (self.GameType, self.Environment, self.TextLocale))
+
+	@classmethod
+	def get(cls, game_type: TOCGameType, environment: TOCEnvironment, text_locale: TOCTextLocale) -> "TOCContextKey":
+		"""Returns the shared key for the given values, creating it the first time"""
+		values = (game_type, environment, text_locale)
+		key = _CONTEXT_KEYS.get(values)
+		if key is None:
+			key = _CONTEXT_KEYS.setdefault(values, cls(game_type, environment, text_locale))
+
+		return key
+
+	@classmethod
+	def of(cls, ctx: "TOCEvaluationContext | TOCContextKey") -> "TOCContextKey":
+		"""Returns the key of an evaluation context, or the key itself"""
+		if isinstance(ctx, TOCContextKey):
+			return ctx
+
+		return cls.get(ctx.GameType, ctx.Environment, ctx.TextLocale)
+
+	def to_context(self, loaded_addons: Optional[dict[str, bool]] = None) -> "TOCEvaluationContext":
+		"""Creates a new evaluation context with these values, and its own loaded addon state"""
+		return TOCEvaluationContext(self.GameType, self.Environment, self.TextLocale, dict(loaded_addons or {}))
+
+
+_CONTEXT_KEYS: dict[tuple, TOCContextKey] = {}
+
+
 @dataclass
 class TOCEvaluationContext:
 	GameType: TOCGameType
@@ -17,6 +62,10 @@ class TOCEvaluationContext:
 		except KeyError:
 			raise KeyError(f"Unknown GameType specified: {self.GameType}")
 
+	@property
+	def Key(self) -> TOCContextKey:
+		return TOCContextKey.get(self.GameType, self.Environment, self.TextLocale)
+
 	def load_addon(self, addon_name: str):
 		self.LoadedAddons[addon_name] = True
 
@@ -0,0 +1,220 @@
+import os
+
+from pathlib import Path
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union, Optional, Iterator
+
+from .enums import *
+from .parser import TOCColumnarAST
+from .toc import TOCFile
+from .cache import TOCParseCache, CACHE_KIND_COLUMNAR
+
+# the client also accepts 'MyAddon-Mainline.toc'
+TOC_FILE_SUFFIX_SEPARATORS = ("_", "-")
+
+SCAN_CHUNK_SIZE = 64
+
+
+@dataclass(slots=True)
+class TOCAddonFile:
+    """One of the .toc files of an addon. GameType is None for the generic 'MyAddon.toc'.
+
+    Files are scanned into a TOCColumnarAST, and the TOCFile is only built from it when `TOC` is first read.
+    If that fails, the exception is recorded in `Error` and `TOC` is None."""
+
+    Path: Path
+    GameType: Optional[TOCGameType] = None
+    AST: Optional[TOCColumnarAST] = field(default=None, repr=False)
+    Error: Optional[Exception] = None
+    _TOC: Optional[TOCFile] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def Success(self) -> bool:
+        return self.Error is None
+
+    @property
+    def TOC(self) -> Optional[TOCFile]:
+        if self._TOC is None and self.AST is not None and self.Error is None:
+            try:
+                self._TOC = TOCFile.from_columnar(self.AST, self.Path)
+            except Exception as e:
+                self.Error = e
+
+        return self._TOC
+
+
+@dataclass(slots=True)
+class TOCAddon:
+    Name: str
+    Directory: Path
+    Files: list[TOCAddonFile] = field(default_factory=list)
+
+    def get_file(self, game_type: Optional[TOCGameType] = None) -> Optional[TOCAddonFile]:
+        """Returns the .toc file the client would load for the given game type: the one for the game type itself, then its family, then the generic one"""
+        by_game_type = {addon_file.GameType: addon_file for addon_file in self.Files}
+        if game_type is not None:
+            if game_type in by_game_type:
+                return by_game_type[game_type]
+
+            family = TOC_GAME_TYPE_TO_FAMILY.get(game_type)
+            family_game_type = TOC_FILE_SUFFIX_TO_GAME_TYPE.get(family.lower()) if family is not None else None
+            if family_game_type in by_game_type:
+                return by_game_type[family_game_type]
+
+        return by_game_type.get(None)
+
+    def get_toc(self, game_type: Optional[TOCGameType] = None) -> Optional[TOCFile]:
+        addon_file = self.get_file(game_type)
+        return addon_file.TOC if addon_file is not None else None
+
+
+@dataclass(slots=True)
+class TOCCorpus:
+    """A set of addons found by scan_addons(), by addon (folder) name"""
+
+    Root: Path
+    Addons: dict[str, TOCAddon] = field(default_factory=dict)
+
+    def __getitem__(self, addon_name: str) -> TOCAddon:
+        return self.Addons[addon_name]
+
+    def __contains__(self, addon_name: str) -> bool:
+        return addon_name in self.Addons
+
+    def __iter__(self) -> Iterator[TOCAddon]:
+        return iter(self.Addons.values())
+
+    def __len__(self) -> int:
+        return len(self.Addons)
+
+    def iter_files(self) -> Iterator[TOCAddonFile]:
+        for addon in self.Addons.values():
+            yield from addon.Files
+
+    @property
+    def Errors(self) -> list[TOCAddonFile]:
+        return [addon_file for addon_file in self.iter_files() if addon_file.Error is not None]
+
+
+def get_toc_file_game_type(addon_name: str, file_name: str) -> tuple[bool, Optional[TOCGameType]]:
+    """Checks if `file_name` is a .toc file of the addon `addon_name`, returning whether it is and the game type it's for, if it's flavor-specific"""
+    stem, ext = os.path.splitext(file_name)
+    if ext.lower() != ".toc":
+        return False, None
+
+    name_length = len(addon_name)
+    if stem[:name_length].lower() != addon_name.lower():
+        return False, None
+
+    if len(stem) == name_length:
+        return True, None
+
+    if stem[name_length] not in TOC_FILE_SUFFIX_SEPARATORS:
+        return False, None
+
+    game_type = TOC_FILE_SUFFIX_TO_GAME_TYPE.get(stem[name_length + 1 :].lower())
+    return game_type is not None, game_type
+
+
+def find_addon(directory: Union[str, Path]) -> Optional[TOCAddon]:
+    """Finds the .toc files of the addon in `directory`, without parsing them. Returns None if it has none, or doesn't exist."""
+    directory = Path(directory)
+    addon = TOCAddon(directory.name, directory)
+    try:
+        with os.scandir(directory) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                is_toc, game_type = get_toc_file_game_type(addon.Name, entry.name)
+                if is_toc and entry.is_file():
+                    addon.Files.append(TOCAddonFile(Path(entry.path), game_type))
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    return addon if addon.Files else None
+
+
+def get_addons_root(root: Union[str, Path]) -> Path:
+    """Returns the AddOns folder for `root`, which can be an AddOns folder or a game folder containing Interface/AddOns"""
+    root = Path(root)
+    if (root / "Interface" / "AddOns").is_dir():
+        root = root / "Interface" / "AddOns"
+
+    return root
+
+
+def discover_addons(root: Union[str, Path]) -> TOCCorpus:
+    """Finds every addon folder under `root` and its .toc files, without parsing them. See get_addons_root for what `root` can be."""
+    corpus = TOCCorpus(get_addons_root(root))
+    with os.scandir(corpus.Root) as folders:
+        for folder in sorted(folders, key=lambda entry: entry.name):
+            if not folder.is_dir():
+                continue
+
+            addon = find_addon(folder.path)
+            if addon is not None:
+                corpus.Addons[addon.Name] = addon
+
+    return corpus
+
+
+def parse_addon_file(path: Union[str, Path]) -> TOCColumnarAST:
+    """Reads one .toc file the way scan_addons does, into a TOCColumnarAST. See TOCAddonFile for how its TOCFile is built."""
+    return TOCColumnarAST.from_file(path)
+
+
+def _scan_toc(path: Path) -> tuple[Optional[TOCColumnarAST], Optional[Exception]]:
+    # only the columnar AST is sent back, it's a fraction of the cost of a TOCFile to pickle and unpickle.
+    # sending TOCFiles made the parent process the bottleneck, to the point where a pool was slower than scanning in one process
+    try:
+        return parse_addon_file(path), None
+    except Exception as e:
+        return None, e
+
+
+def scan_addons(root: Union[str, Path], jobs: Optional[int] = None, cache: Optional[TOCParseCache] = None) -> TOCCorpus:
+    """Finds and tokenizes every addon under `root`, see discover_addons. Files are read in a pool of `jobs` processes, or in this one if `jobs` is 1.
+    Each file gets a TOCColumnarAST, and its TOCFile is built from that when first read, see TOCAddonFile.
+
+    A file that fails to load has its exception recorded in its `Error`, and doesn't stop the others. `TOCCorpus.Errors` lists them.
+    With a `cache`, files that haven't changed since they were cached aren't read again, and the rest are cached once read."""
+    corpus = discover_addons(root)
+    addon_files = list(corpus.iter_files())
+
+    stats = {}
+    if cache is not None:
+        misses = []
+        for addon_file in addon_files:
+            try:
+                stat = os.stat(addon_file.Path)
+            except OSError as e:
+                addon_file.Error = e
+                continue
+
+            addon_file.AST = cache.get(addon_file.Path, CACHE_KIND_COLUMNAR, stat)
+            if addon_file.AST is None:
+                stats[addon_file.Path] = stat
+                misses.append(addon_file)
+
+        addon_files = misses
+
+    paths = [addon_file.Path for addon_file in addon_files]
+    with ExitStack() as stack:
+        if jobs == 1 or len(paths) <= 1:
+            results = map(_scan_toc, paths)
+        else:
+            # big enough chunks to keep pickling overhead down, small enough to keep every worker busy until the end
+            workers = jobs or os.cpu_count() or 1
+            chunk_size = max(1, min(SCAN_CHUNK_SIZE, len(paths) // (workers * 4)))
+            pool = stack.enter_context(ProcessPoolExecutor(jobs))
+            results = pool.map(_scan_toc, paths, chunksize=chunk_size)
+
+        for addon_file, (ast, error) in zip(addon_files, results):
+            addon_file.AST, addon_file.Error = ast, error
+            if ast is not None and cache is not None:
+                cache.put(addon_file.Path, CACHE_KIND_COLUMNAR, ast, stats[addon_file.Path])
+
+    if cache is not None:
+        cache.flush()
+
+    return corpus
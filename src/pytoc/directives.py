@@ -1,15 +1,15 @@
 from collections.abc import Callable
-from typing import Optional, List, Type
-from dataclasses import dataclass, field
+from typing import Optional, List, Type, Any, get_args, get_origin
+from dataclasses import dataclass, field, replace
 
 
 from .enums import TOCTextLocale
 from .utils import StringToBoolean
 from .shared import PYTOC_DEFAULT_LOCALE
-from .load_conditions import TOCAllowLoad, TOCAllowLoadGameType, TOCAllowLoadTextLocale
+from .load_conditions import TOCCondition, TOCAllowLoad, TOCAllowLoadGameType, TOCAllowLoadTextLocale
 
 
-@dataclass
+@dataclass(slots=True)
 class TOCBoolType:
     _Raw: str
     Value: bool
@@ -27,13 +27,13 @@ class TOCBoolType:
         return self.Value
 
 
-@dataclass
+@dataclass(slots=True)
 class TOCIntValue:
     Raw: str
     Value: int
 
 
-@dataclass
+@dataclass(slots=True)
 class TOCListValue[T]:
     Raw: str
     Value: List[T]
@@ -41,6 +41,9 @@ class TOCListValue[T]:
     Converter: Callable[[str], T] = field(repr=False, default=None)
     _nextindex: int = 0
 
+    # called after the value is changed in place by `append`, i.e. to mark the owning TOCFile attribute as dirty
+    OnChanged: Optional[Callable[[], None]] = field(default=None, kw_only=True, repr=False, compare=False)
+
     def __post_init__(self):
         if self.Converter is None:
             return
@@ -90,7 +93,7 @@ class TOCListValue[T]:
                     if other_value is None:
                         return False
             else:
-                return super().__eq__(other)
+                return NotImplemented
         except ValueError:
             return False
 
@@ -109,25 +112,28 @@ class TOCListValue[T]:
         self.__post_init__()
 
     def append(self, raw: str, value: str):
-        raw = self.Raw.removesuffix("\n")
-        raw += f", {raw}"
-        if not raw.endswith("\n"):
-            raw += "\n"
+        new_raw = self.Raw.removesuffix("\n")
+        new_raw += ", " + raw.removesuffix("\n")
+        if not new_raw.endswith("\n"):
+            new_raw += "\n"
 
-        self.Raw = raw
+        self.Raw = new_raw
         self.Value.append(value)
 
         # trigger conversions again if necessary
         self.__post_init__()
 
+        if self.OnChanged is not None:
+            self.OnChanged()
 
-@dataclass
+
+@dataclass(slots=True)
 class TOCEnumValue[T]:
     Raw: str
     Value: T
 
 
-@dataclass
+@dataclass(slots=True)
 class TOCUnkValue:
     Raw: str
     Value: str
@@ -138,10 +144,10 @@ class TOCUnkValue:
     def __eq__(self, other):
         if isinstance(other, str):
             return self.__str__() == other
-        return super().__eq__(other)
+        return NotImplemented
 
 
-@dataclass
+@dataclass(slots=True)
 class TOCLocalizedDirectiveValue:
     Raw: str
     Localizations: dict[TOCTextLocale, str] = field(default_factory=dict)
@@ -171,7 +177,7 @@ class TOCLocalizedDirectiveValue:
         elif isinstance(other, TOCLocalizedDirectiveValue):
             return self.__str__() == other.__str__()
         else:
-            return super().__eq__(other)
+            return NotImplemented
 
     def get_translation(self, locale: TOCTextLocale) -> Optional[str]:
         return self.Localizations.get(locale)
@@ -193,7 +199,7 @@ class TOCLocalizedDirectiveValue:
 # schema
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TOCDirectiveSpec:
     Name: str
     ValueType: Type  # i.e. TOCBoolType, etc
@@ -201,6 +207,46 @@ class TOCDirectiveSpec:
     AliasFunc: Callable[[str], bool] = None  # func that takes in the directive name, and returns true if it is an alias
     CanBeLocalized: bool = False
     AllowDuplicates: bool = True
+    AliasPrefixes: Optional[tuple[str, ...]] = None  # case-insensitive name prefixes that are aliases, i.e. 'Deps' for 'DepsFoo'
+    Converter: Callable[[str], Any] = field(default=None, compare=False, repr=False)  # built by the registry, see compile_value_converter
+
+
+def compile_value_converter(spec: TOCDirectiveSpec) -> Callable[[str], Any]:
+    """Builds a function that converts a raw directive value into the spec's ValueType, so the type only has to be inspected once"""
+    value_type = spec.ValueType
+    origin = get_origin(value_type)
+
+    if value_type is TOCBoolType:
+        return lambda raw: TOCBoolType(raw, StringToBoolean(raw.strip()))
+
+    if value_type is TOCIntValue:
+
+        def convert_int(raw: str) -> TOCIntValue:
+            try:
+                return TOCIntValue(raw, int(raw))
+            except ValueError:
+                raise ValueError(f"Expected integer for {spec.Name}, got: {raw}")
+
+        return convert_int
+
+    if value_type is TOCLocalizedDirectiveValue:
+        return TOCLocalizedDirectiveValue
+
+    if origin is TOCListValue:
+        (item_type,) = get_args(value_type)
+        if item_type is str:
+            return lambda raw: TOCListValue(raw, [v for v in map(str.strip, raw.split(",")) if v])
+
+        return lambda raw: TOCListValue(raw, [item_type(v) for v in map(str.strip, raw.split(",")) if v])
+
+    if origin is TOCEnumValue:
+        (enum_type,) = get_args(value_type)
+        return lambda raw: TOCEnumValue(raw, enum_type[raw.strip()])
+
+    if isinstance(value_type, type) and issubclass(value_type, TOCCondition):
+        return lambda raw: value_type(frozenset(v for v in map(str.strip, raw.split(",")) if v))
+
+    return value_type
 
 
 TOC_DIRECTIVES: dict[str, TOCDirectiveSpec] = {
@@ -248,7 +294,7 @@ TOC_DIRECTIVES: dict[str, TOCDirectiveSpec] = {
         Name="Dependencies",
         ValueType=TOCListValue[str],
         Aliases=("Dependencies", "Deps", "RequiredDeps"),
-        AliasFunc=lambda name: name.lower().startswith("deps"),
+        AliasPrefixes=("Deps",),
         AllowDuplicates=True,
     ),
     "OptionalDeps": TOCDirectiveSpec(
@@ -275,15 +321,88 @@ TOC_DIRECTIVES: dict[str, TOCDirectiveSpec] = {
 ALIAS_TO_CANONICAL: dict[str, str] = dict()
 ALIAS_FUNCTIONS: dict[str, Callable[[str], bool]] = dict()
 
-for spec in TOC_DIRECTIVES.values():
-    if spec.Aliases:
+
+class TOCDirectiveRegistry:
+    """Dispatch table mapping raw directive names (including aliases and alias prefixes) to their canonical name and spec.
+
+    Built once from the default directives and updated in place when new specs are registered."""
+
+    # resolved names are memoized, this keeps vendor-specific junk from growing the memo forever
+    MAX_MEMOIZED_NAMES = 4096
+
+    def __init__(self, specs: dict[str, TOCDirectiveSpec], aliases: dict[str, str], alias_funcs: dict[str, Callable[[str], bool]]):
+        self.Specs = specs
+        self.Aliases = aliases
+        self.AliasFuncs = alias_funcs
+        self._prefixes: dict[int, dict[str, str]] = dict()  # prefix length -> lowercase prefix -> canonical name
+        self._resolved: dict[str, tuple[str, Optional[TOCDirectiveSpec]]] = dict()  # raw name -> (canonical name, spec)
+
+        for spec in list(specs.values()):
+            self.register(spec)
+
+    def register(self, spec: TOCDirectiveSpec):
+        if spec.Converter is None:
+            spec = replace(spec, Converter=compile_value_converter(spec))
+
+        names = (spec.Name,) + (spec.Aliases or ())
+        for name in names:
+            self.Aliases[name] = spec.Name
+            self.Aliases[name.lower()] = spec.Name
+
+        prefixes = tuple(prefix.lower() for prefix in spec.AliasPrefixes or ())
+        for prefix in prefixes:
+            self._prefixes.setdefault(len(prefix), dict())[prefix] = spec.Name
+
         if spec.AliasFunc is not None:
-            ALIAS_FUNCTIONS[spec.Name] = spec.AliasFunc
-            ALIAS_FUNCTIONS[spec.Name.lower()] = spec.AliasFunc
-
-        for name in spec.Aliases:
-            ALIAS_TO_CANONICAL[name] = spec.Name
-            ALIAS_TO_CANONICAL[name.lower()] = spec.Name
-    else:
-        ALIAS_TO_CANONICAL[spec.Name] = spec.Name
-        ALIAS_TO_CANONICAL[spec.Name.lower()] = spec.Name
+            self.AliasFuncs[spec.Name] = spec.AliasFunc
+            self.AliasFuncs[spec.Name.lower()] = spec.AliasFunc
+
+        self.Specs[spec.Name] = spec
+
+        # only forget the lookups this spec can change
+        if spec.AliasFunc is not None:
+            self._resolved.clear()
+        else:
+            lowered = {name.lower() for name in names}
+            stale = [name for name in self._resolved if name.lower() in lowered or name.lower().startswith(prefixes)]
+            for name in stale:
+                del self._resolved[name]
+
+    def resolve(self, name: str) -> tuple[str, Optional[TOCDirectiveSpec]]:
+        """Returns the canonical name and spec for a directive name (without a locale suffix). Unknown directives resolve to (name, None)."""
+        resolved = self._resolved.get(name)
+        if resolved is not None:
+            return resolved
+
+        key = name.lower()
+        canonical = self.Aliases.get(key)
+        if canonical is None:
+            for length, prefixes in self._prefixes.items():
+                canonical = prefixes.get(key[:length])
+                if canonical is not None:
+                    break
+
+        if canonical is None:
+            for spec_name, func in self.AliasFuncs.items():
+                if func(name):
+                    canonical = self.Specs[spec_name].Name
+                    break
+
+        if canonical is None:
+            resolved = (name, None)
+        else:
+            resolved = (canonical, self.Specs.get(canonical))
+
+        if len(self._resolved) >= self.MAX_MEMOIZED_NAMES:
+            self._resolved.clear()
+
+        self._resolved[name] = resolved
+        return resolved
+
+
+TOC_DIRECTIVE_REGISTRY = TOCDirectiveRegistry(TOC_DIRECTIVES, ALIAS_TO_CANONICAL, ALIAS_FUNCTIONS)
+
+
+def register_directive(spec: TOCDirectiveSpec):
+    """Registers a custom directive spec, or replaces the spec of an existing directive"""
+    TOC_DIRECTIVE_REGISTRY.register(spec)
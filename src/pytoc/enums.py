@@ -1,4 +1,4 @@
-from enum import StrEnum, Enum
+from enum import StrEnum, IntEnum, Enum
 
 
 class TOCGameType(StrEnum):
@@ -56,6 +56,13 @@ TOC_GAME_TYPE_TO_FAMILY = {
     TOCGameType.Mists: TOCFamily.Classic,
 }
 
+# client-specific TOC files are named like 'MyAddon_Mainline.toc', the suffix picks the game type the file is for
+TOC_FILE_SUFFIX_TO_GAME_TYPE = {game_type.name.lower(): game_type for game_type in TOCGameType} | {
+    "bcc": TOCGameType.TBC,
+    "wotlkc": TOCGameType.Wrath,
+}
+TOC_GAME_TYPE_TO_FILE_SUFFIX = {game_type: game_type.name for game_type in TOCGameType}
+
 
 class TOCAddonLoadError(Enum):
     Success = 1
@@ -63,3 +70,16 @@ class TOCAddonLoadError(Enum):
     WrongEnvironment = 3
     WrongTextLocale = 4
     MissingDependency = 5
+
+
+class TOCChangeKind(Enum):
+    Added = 1
+    Changed = 2
+    Removed = 3
+
+
+class TOCLineKind(IntEnum):
+    Empty = 0
+    Comment = 1
+    Directive = 2
+    FileEntry = 3
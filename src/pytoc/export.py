@@ -0,0 +1,161 @@
+import os
+import secrets
+import itertools
+
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Union, Iterable, Iterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .toc import TOCFile
+
+EXPORT_TEMP_FILE_ATTEMPTS = 100
+
+
+def match_file(path: Union[str, Path], chunks: Iterator[bytes]) -> tuple[bool, list[bytes]]:
+    """Reads `chunks` for as long as they match the contents of `path`, stopping at the first difference.
+    Returns whether they make up the whole file, and the chunks that were read."""
+    read = []
+    with open(path, "rb") as f:
+        for chunk in chunks:
+            read.append(chunk)
+            if f.read(len(chunk)) != chunk:
+                return False, read
+
+        return f.read(1) == b"", read
+
+
+def create_temp_file(path: Path, mode: int = 0o666) -> tuple[int, Path]:
+    """Creates a new, uniquely named file next to `path` and returns its descriptor and path.
+
+    The umask is applied to `mode` just like open() would, so a new file gets the permissions a plain write would have given it."""
+    for _ in range(EXPORT_TEMP_FILE_ATTEMPTS):
+        temp_path = path.with_name(f".{path.name}.{secrets.token_hex(4)}.tmp")
+        try:
+            return os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), mode), temp_path
+        except FileExistsError:
+            continue
+
+    raise FileExistsError(f"Unable to create a temporary file next to '{path}'")
+
+
+def write_text_atomic(path: Union[str, Path], chunks: Iterable[str], skip_unchanged: bool = True, encoding: str = "utf-8") -> bool:
+    """Streams `chunks` into a temporary file next to `path`, then renames it over `path` in one step.
+
+    With `skip_unchanged`, nothing is written if `path` already holds the exact same bytes, leaving it (and its mtime) untouched.
+    Returns True if `path` was written."""
+    path = Path(path)
+    data = (chunk.encode(encoding) for chunk in chunks)
+
+    try:
+        existing = os.stat(path)
+    except FileNotFoundError:
+        existing = None
+
+    if existing is not None and skip_unchanged:
+        # compared as the chunks come in, so an unchanged file is only read, and a changed one usually only up to the first difference
+        unchanged, read = match_file(path, data)
+        if unchanged:
+            return False
+
+        data = itertools.chain(read, data)
+
+    fd, temp_path = create_temp_file(path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if existing is not None:
+                # an existing file keeps its permissions, as chmod isn't subject to the umask
+                os.chmod(temp_path, existing.st_mode & 0o7777)
+
+            f.writelines(data)
+
+            # make sure the data is on disk before the rename makes it the file, or a crash could leave an empty file behind
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return True
+
+
+def write_toc_text(export_path: Union[str, Path], chunks: Iterable[str], overwrite: bool = False, atomic: bool = False) -> bool:
+    """Writes already rendered TOC text to `export_path`, see TOCFile.export"""
+    if not isinstance(export_path, Path):
+        export_path = Path(export_path)
+
+    if export_path.exists() and not overwrite:
+        raise FileExistsError(f"File already exists at the provided export path. To overwrite, pass `overwrite=True` into TOCFile.Export().")
+
+    if atomic:
+        return write_text_atomic(export_path, chunks)
+
+    with open(export_path, "w", encoding="utf-8", newline="") as f:
+        f.writelines(chunks)
+
+    return True
+
+
+def render_toc(toc: "TOCFile") -> str:
+    """Syncs a TOCFile and returns its full text"""
+    toc.sync_all()
+    return "".join(toc._AST.iter_text())
+
+
+@dataclass(slots=True)
+class TOCExportResult:
+    Path: Path
+    Written: bool = False
+    Error: Optional[Exception] = None
+
+    @property
+    def Success(self) -> bool:
+        return self.Error is None
+
+
+def export_many(
+    exports: Iterable[tuple["TOCFile", Union[str, Path]]],
+    jobs: Optional[int] = None,
+    overwrite: bool = False,
+    atomic: bool = False,
+    use_processes: bool = False,
+) -> list[TOCExportResult]:
+    """Exports many TOC files at once, writing them from a pool of `jobs` threads. Returns one result per export, in order.
+
+    A failed export is recorded in its result's `Error` and doesn't stop the others.
+    With `use_processes`, syncing and rendering happen in a process pool instead. The TOCFile objects given are pickled
+    into the worker processes, so they themselves are left unsynced."""
+    exports = [(toc, Path(path)) for toc, path in exports]
+    results = [TOCExportResult(path) for _, path in exports]
+
+    def record(result: TOCExportResult, func, *args):
+        try:
+            result.Written = func(*args)
+        except Exception as e:
+            result.Error = e
+
+    with ThreadPoolExecutor(jobs) as writers:
+        if not use_processes:
+            for (toc, path), result in zip(exports, results):
+                writers.submit(record, result, toc.export, path, overwrite, atomic)
+
+            return results
+
+        with ProcessPoolExecutor(jobs) as renderers:
+            futures = [renderers.submit(render_toc, toc) for toc, _ in exports]
+            for future, (_, path), result in zip(futures, exports, results):
+                try:
+                    text = future.result()
+                except Exception as e:
+                    result.Error = e
+                    continue
+
+                writers.submit(record, result, write_toc_text, path, (text,), overwrite, atomic)
+
+    return results
@@ -1,7 +1,7 @@
 import re
 
-from typing import Optional
-from dataclasses import dataclass
+from typing import Optional, Container, Iterable
+from dataclasses import dataclass, field
 
 from .enums import *
 from .load_conditions import *
@@ -13,28 +13,95 @@ _TOC_VAR_PATTERN = re.compile(r"\[([A-Za-z0-9_]+)\]")
 
 _TOC_DEFAULT_VARIABLES = {"family": lambda ctx: ctx.Family, "game": lambda ctx: ctx.GameType, "textlocale": lambda ctx: ctx.TextLocale}
 
+# variable values only depend on these, so each variable table is built once per combination
+_TOC_VARIABLE_TABLES: dict[tuple, dict[str, str]] = {}
 
-@dataclass(frozen=True)
+
+def get_path_variable_table(ctx: TOCEvaluationContext) -> dict[str, str]:
+    """Returns the value of every file path variable in the given context, by lowercase name. Tables are cached, don't change them."""
+    key = (ctx.GameType, ctx.TextLocale)
+    try:
+        return _TOC_VARIABLE_TABLES[key]
+    except KeyError:
+        pass
+
+    table = {}
+    for name, get_value in _TOC_DEFAULT_VARIABLES.items():
+        try:
+            value = get_value(ctx)
+        except KeyError:
+            continue  # i.e. no family for an unknown game type, this only fails if the variable is used
+
+        if value is not None:
+            table[name] = str(value)
+
+    _TOC_VARIABLE_TABLES[key] = table
+    return table
+
+
+@dataclass(frozen=True, slots=True)
 class TOCFileEntry:
-    """A file found in the 'files' section of a TOC file. Represents the .lua and .xml files."""
+    """A file found in the 'files' section of a TOC file. Represents the .lua and .xml files.
+
+    `Conditions` can be given as any iterable, and is stored as a tuple."""
 
     RawFilePath: str
-    Conditions: Optional[list[TOCCondition]] = None
+    Conditions: Optional[tuple[TOCCondition, ...]] = None
+    ConditionMask: Optional[int] = field(init=False, repr=False, compare=False)
+    PathSegments: Optional[tuple[str, ...]] = field(init=False, repr=False, compare=False)  # literals at even indices, variable names at odd ones
+
+    def __post_init__(self):
+        # conditions and path templates are compiled once here. File entries are frozen and their conditions a tuple, so neither can go stale
+        if self.Conditions is not None and not isinstance(self.Conditions, tuple):
+            object.__setattr__(self, "Conditions", tuple(self.Conditions))
+
+        object.__setattr__(self, "ConditionMask", compile_conditions(self.Conditions))
+        segments = tuple(_TOC_VAR_PATTERN.split(self.RawFilePath)) if "[" in self.RawFilePath else None
+        object.__setattr__(self, "PathSegments", segments if segments and len(segments) > 1 else None)
 
     def __str__(self):
         return self.RawFilePath
 
-    def resolve_path(self, ctx: TOCEvaluationContext) -> str:
-        def replace(match: re.Match):
-            name = match.group(1)
+    def __reduce__(self):
+        # restores the compiled fields as they are, instead of compiling them again or going through the generic dataclass __setstate__
+        return _restore_file_entry, (self.RawFilePath, self.Conditions, self.ConditionMask, self.PathSegments)
+
+    def resolve_path(self, ctx: TOCEvaluationContext, variables: Optional[Container[str]] = None) -> str:
+        """Substitutes path variables like [Family] for their values in the given context. If `variables` is given, only those (lowercase) are substituted."""
+        segments = self.PathSegments
+        if segments is None:
+            return self.RawFilePath
+
+        table = get_path_variable_table(ctx)
+        parts = list(segments)
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            key = name.lower()
+            if variables is not None and key not in variables:
+                parts[i] = f"[{name}]"
+                continue
+
             try:
-                return _TOC_DEFAULT_VARIABLES[name.lower()](ctx)
+                parts[i] = table[key]
             except KeyError:
                 raise KeyError(f"Undefined file path variable: {name}")
 
-        return _TOC_VAR_PATTERN.sub(replace, self.RawFilePath)
+        return "".join(parts)
+
+    def get_path_variables(self) -> list[str]:
+        """Returns the (lowercase) names of the variables used in this file's path"""
+        if self.PathSegments is None:
+            return []
+
+        return [name.lower() for name in self.PathSegments[1::2]]
 
     def should_load(self, ctx: TOCEvaluationContext) -> bool:
+        mask = self.ConditionMask
+        if mask is not None:
+            key = get_condition_key(ctx)
+            if key is not None:
+                return mask & key == key
+
         should_load = True
         if self.Conditions:
             for condition in self.Conditions:
@@ -50,7 +117,33 @@ class TOCFileEntry:
 
         if self.Conditions:
             for condition in self.Conditions:
-                condition_str = f" {condition.export()}"
+                condition_str = f" {condition.export(add_newline=False)}"
                 path += condition_str
 
         return path.strip()
+
+
+def _restore_file_entry(
+    raw_file_path: str, conditions: Optional[tuple[TOCCondition, ...]], condition_mask: Optional[int], path_segments: Optional[tuple[str, ...]]
+):
+    entry = object.__new__(TOCFileEntry)
+    object.__setattr__(entry, "RawFilePath", raw_file_path)
+    object.__setattr__(entry, "Conditions", conditions)
+    object.__setattr__(entry, "ConditionMask", condition_mask)
+    object.__setattr__(entry, "PathSegments", path_segments)
+    return entry
+
+
+def evaluate_file_entries(entries: Iterable[TOCFileEntry], ctx: TOCEvaluationContext) -> list[bool]:
+    """Evaluates the load conditions of many file entries against a single context, returning whether each one should load"""
+    key = get_condition_key(ctx)
+    if key is None:
+        return [entry.should_load(ctx) for entry in entries]
+
+    results = []
+    append = results.append
+    for entry in entries:
+        mask = entry.ConditionMask
+        append(mask & key == key if mask is not None else entry.should_load(ctx))
+
+    return results
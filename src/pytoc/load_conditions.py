@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, ClassVar, Iterable, Optional
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 
@@ -9,47 +9,54 @@ from .context import TOCEvaluationContext
 
 
 class TOCCondition(ABC):
+    __slots__ = ()
+
     Values: frozenset[Any]
     ExportName: str
+    Dimension: ClassVar[Optional[str]] = None  # the context attribute this condition depends on, used to compile it to a mask
 
     @abstractmethod
     def evaluate(self, ctx: TOCEvaluationContext) -> bool: ...
 
     def export(self, add_newline: bool = True) -> str:
-        return f"[{self.ExportName} " + ", ".join(self.Values) + "]" + "\n" if add_newline else ""
+        return f"[{self.ExportName} " + ", ".join(self.Values) + "]" + ("\n" if add_newline else "")
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TOCAllowLoad(TOCCondition):
     Values: frozenset[TOCEnvironment]
     ExportName: str = "AllowLoad"
+    Dimension: ClassVar[str] = "Environment"
 
     def evaluate(self, ctx: TOCEvaluationContext) -> bool:
         return ctx.Environment in self.Values or TOCEnvironment.Both in self.Values
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TOCAllowLoadEnvironment(TOCCondition):
     Values: frozenset[TOCEnvironment]
     ExportName: str = "AllowLoadEnvironment"
+    Dimension: ClassVar[str] = "Environment"
 
     def evaluate(self, ctx: TOCEvaluationContext) -> bool:
         return ctx.Environment in self.Values or TOCEnvironment.Both in self.Values
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TOCAllowLoadGameType(TOCCondition):
     Values: frozenset[TOCGameType]
     ExportName: str = "AllowLoadGameType"
+    Dimension: ClassVar[str] = "GameType"
 
     def evaluate(self, ctx: TOCEvaluationContext) -> bool:
         return ctx.GameType in self.Values
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TOCAllowLoadTextLocale(TOCCondition):
     Values: frozenset[TOCTextLocale]
     ExportName: str = "AllowLoadTextLocale"
+    Dimension: ClassVar[str] = "TextLocale"
 
     def evaluate(self, ctx: TOCEvaluationContext) -> bool:
         return ctx.TextLocale in self.Values
@@ -58,37 +65,120 @@ class TOCAllowLoadTextLocale(TOCCondition):
 # inverse conditions (why? because)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TOCExcludeLoad(TOCCondition):
     Values: frozenset[TOCEnvironment]
     ExportName: str = "ExcludeLoad"
+    Dimension: ClassVar[str] = "Environment"
 
     def evaluate(self, ctx: TOCEvaluationContext) -> bool:
         return ctx.Environment not in self.Values or TOCEnvironment.Both not in self.Values
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TOCExcludeLoadEnvironment(TOCCondition):
     Values: frozenset[TOCEnvironment]
     ExportName: str = "ExcludeLoadEnvironment"
+    Dimension: ClassVar[str] = "Environment"
 
     def evaluate(self, ctx: TOCEvaluationContext) -> bool:
         return ctx.Environment not in self.Values or TOCEnvironment.Both not in self.Values
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TOCExcludeLoadGameType(TOCCondition):
     Values: frozenset[TOCGameType]
     ExportName: str = "ExcludeLoadGameType"
+    Dimension: ClassVar[str] = "GameType"
 
     def evaluate(self, ctx: TOCEvaluationContext) -> bool:
         return ctx.GameType not in self.Values
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TOCExcludeLoadTextLocale(TOCCondition):
     Values: frozenset[TOCTextLocale]
     ExportName: str = "ExcludeLoadTextLocale"
+    Dimension: ClassVar[str] = "TextLocale"
 
     def evaluate(self, ctx: TOCEvaluationContext) -> bool:
         return ctx.TextLocale not in self.Values
+
+
+# compiled conditions
+# every (GameType, Environment, TextLocale) value gets its own bit in a single int, so a set of conditions compiles to the mask of
+# values it allows, and a context compiles to a key with one bit per dimension set. the conditions pass if all of the key's bits are in the mask
+
+CONDITION_DIMENSIONS = {"GameType": TOCGameType, "Environment": TOCEnvironment, "TextLocale": TOCTextLocale}
+
+_CONDITION_BITS: dict[str, dict[Any, int]] = {}
+_shift = 0
+for _dimension, _enum in CONDITION_DIMENSIONS.items():
+    _CONDITION_BITS[_dimension] = {value: 1 << (_shift + i) for i, value in enumerate(_enum)}
+    _shift += len(_enum)
+
+CONDITION_MASK_ALL = (1 << _shift) - 1
+
+_CONDITION_MASKS: dict[TOCCondition, int] = {}
+_CONDITION_KEYS: dict[tuple, int] = {}
+
+
+def compile_condition(condition: TOCCondition) -> Optional[int]:
+    """Compiles a condition to the mask of context values it allows, or None if it can't be compiled. Results are cached per condition."""
+    try:
+        return _CONDITION_MASKS[condition]
+    except (KeyError, TypeError):
+        pass
+
+    dimension = getattr(condition, "Dimension", None)
+    if dimension not in CONDITION_DIMENSIONS:
+        return None
+
+    # conditions are evaluated against every value of their dimension, so the mask behaves exactly like evaluate() does
+    defaults = {name: next(iter(enum)) for name, enum in CONDITION_DIMENSIONS.items()}
+    mask = CONDITION_MASK_ALL
+    for value, bit in _CONDITION_BITS[dimension].items():
+        if not condition.evaluate(TOCEvaluationContext(**(defaults | {dimension: value}))):
+            mask &= ~bit
+
+    try:
+        _CONDITION_MASKS[condition] = mask
+    except TypeError:
+        pass
+
+    return mask
+
+
+def compile_conditions(conditions: Optional[Iterable[TOCCondition]]) -> Optional[int]:
+    """Compiles a list of conditions to a single mask, or None if any of them can't be compiled"""
+    mask = CONDITION_MASK_ALL
+    for condition in conditions or ():
+        condition_mask = compile_condition(condition)
+        if condition_mask is None:
+            return None
+
+        mask &= condition_mask
+
+    return mask
+
+
+def get_condition_key(ctx: TOCEvaluationContext) -> Optional[int]:
+    """Returns the key of an evaluation context to test condition masks with, or None if the context has values outside of the known enums"""
+    return get_condition_key_for(ctx.GameType, ctx.Environment, ctx.TextLocale)
+
+
+def get_condition_key_for(game_type: TOCGameType, environment: TOCEnvironment, text_locale: TOCTextLocale) -> Optional[int]:
+    """Same as get_condition_key, without needing an evaluation context"""
+    values = (game_type, environment, text_locale)
+    try:
+        return _CONDITION_KEYS[values]
+    except (KeyError, TypeError):
+        pass
+
+    try:
+        key = _CONDITION_BITS["GameType"][game_type] | _CONDITION_BITS["Environment"][environment] | _CONDITION_BITS["TextLocale"][text_locale]
+    except (KeyError, TypeError):
+        return None
+
+    _CONDITION_KEYS[values] = key
+    return key
@@ -1,7 +1,10 @@
 import re
 
-from dataclasses import dataclass
-from typing import Optional, Any, get_args, get_origin
+from array import array
+from types import MemberDescriptorType
+
+from dataclasses import dataclass, field
+from typing import Optional, Any, Callable, Iterable, Iterator, TextIO
 
 from .enums import *
 from .file_entry import *
@@ -9,6 +12,25 @@ from .directives import *
 
 FILE_CONDITION_VARIABLE_PATTERN = re.compile(r"\[([^\]]+)\]")
 
+# classifies a line and splits out the directive name, locale suffix and value in a single match
+LINE_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<empty>\s*\Z)
+    |(?P<directive>\#\#\ (?P<raw>(?P<name>.*?)(?:-(?P<locale>[a-z]{2}[A-Z]{2}))?):\ ?(?P<value>.*))
+    |(?P<comment>\#.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+# indexed by the number of the outermost group that matched (see re.Match.lastindex)
+LINE_TOKEN_KINDS: list[Optional[TOCLineKind]] = [None] * (LINE_TOKEN_PATTERN.groups + 1)
+LINE_TOKEN_KINDS[LINE_TOKEN_PATTERN.groupindex["empty"]] = TOCLineKind.Empty
+LINE_TOKEN_KINDS[LINE_TOKEN_PATTERN.groupindex["directive"]] = TOCLineKind.Directive
+LINE_TOKEN_KINDS[LINE_TOKEN_PATTERN.groupindex["comment"]] = TOCLineKind.Comment
+TEXT_LOCALES = frozenset(TOCTextLocale)
+
+_match_line = LINE_TOKEN_PATTERN.match
+_find_whitespace = re.compile(r"\s").search
+
 CONDITION_DIRECTIVES_TO_CLASS = {
     "AllowLoad": TOCAllowLoad,
     "AllowLoadGameType": TOCAllowLoadGameType,
@@ -22,42 +44,173 @@ CONDITION_DIRECTIVES_TO_CLASS = {
 CONDITION_DIRECTIVES_LOWER = {key.lower() for key in CONDITION_DIRECTIVES_TO_CLASS.keys()}
 
 
+class TOCSource:
+    """A whole TOC file held in a single string, along with the offset each line starts at"""
+
+    __slots__ = ("Text", "LineOffsets")
+
+    def __init__(self, text: str):
+        self.Text = text
+        self.LineOffsets = array("I", [0])
+
+    def __len__(self) -> int:
+        return len(self.LineOffsets) - 1
+
+    def get_span(self, first_line: int, last_line: Optional[int] = None) -> tuple[int, int]:
+        """Returns the (start, end) offsets of the given line, or of the run of lines up to and including `last_line`"""
+        if last_line is None:
+            last_line = first_line
+
+        return self.LineOffsets[first_line], self.LineOffsets[last_line + 1]
+
+    def get_text(self, first_line: int, last_line: Optional[int] = None) -> str:
+        start, end = self.get_span(first_line, last_line)
+        return self.Text[start:end]
+
+
+_SLOT_NAMES: dict[type, tuple[str, ...]] = {}
+
+
+def get_slot_names(cls: type) -> tuple[str, ...]:
+    """Returns the names every slot of a slotted class (its base classes' included) can be read and written through directly.
+
+    A slot that's wrapped in a property, like TOCLineNode.RawText, is listed under the name its slot descriptor was moved to."""
+    names = _SLOT_NAMES.get(cls)
+    if names is None:
+        names = _SLOT_NAMES[cls] = tuple(name for klass in cls.__mro__ for name, value in vars(klass).items() if isinstance(value, MemberDescriptorType))
+
+    return names
+
+
+def get_slot_state(obj: Any) -> tuple[tuple[str, Any], ...]:
+    """Returns the (name, value) of every set slot of `obj`"""
+    state = []
+    for name in get_slot_names(type(obj)):
+        try:
+            state.append((name, getattr(obj, name)))
+        except AttributeError:
+            pass
+
+    return tuple(state)
+
+
+def restore_slot_state(cls: type, state: tuple[tuple[str, Any], ...]) -> Any:
+    obj = cls.__new__(cls)
+    for name, value in state:
+        object.__setattr__(obj, name, value)
+
+    return obj
+
+
+@dataclass(slots=True)
 class TOCLineNode:
+    """Base class of every AST node. Subclasses inherit the LineNumber and RawText fields, and add their own after them."""
+
     LineNumber: int
     RawText: str
-    AllowDuplicates: bool = True
+
+    # the line of the source a source-backed node (see TOCAST.iter_source_nodes) reads its RawText from
+    _SourceLine: int = field(default=0, kw_only=True, repr=False, compare=False)
+
+    AllowDuplicates = True
+
+    def attach_source(self, source: TOCSource, source_line: int):
+        """Drops this node's own RawText in favor of the given line of the shared source"""
+        self._RawText = source
+        self._SourceLine = source_line
+
+    def __copy__(self):
+        # copies slots directly, so a source-backed node stays source-backed instead of getting its own RawText
+        return restore_slot_state(type(self), get_slot_state(self))
+
+    def __reduce__(self):
+        # same as __copy__, this also skips the generic dataclass __setstate__, which is most of the time spent unpickling an AST
+        return restore_slot_state, (type(self), get_slot_state(self))
+
+    def get_source(self) -> Optional[TOCSource]:
+        """Returns the source this node reads its RawText from, or None if it has (or was given) its own"""
+        source = self._RawText
+        return source if isinstance(source, TOCSource) else None
+
+    def is_source_backed(self) -> bool:
+        """Returns True if this node reads its RawText from a TOCSource, False if it has (or was given) its own"""
+        return isinstance(self._RawText, TOCSource)
 
 
-@dataclass
+def _get_raw_text(node: TOCLineNode) -> str:
+    text = node._RawText
+    if isinstance(text, TOCSource):
+        offsets = text.LineOffsets
+        line = node._SourceLine
+        return text.Text[offsets[line] : offsets[line + 1]]
+
+    return text
+
+
+# the RawText slot holds either the node's own text or, for source-backed nodes, the TOCSource it's sliced out of when read.
+# the slot stays reachable as _RawText, and the property is only added once the dataclass is built, as it would otherwise be taken for the field's default
+TOCLineNode._RawText = TOCLineNode.RawText
+TOCLineNode.RawText = property(_get_raw_text, TOCLineNode._RawText.__set__)
+
+
+@dataclass(slots=True)
 class TOCEmptyLine(TOCLineNode):
-    LineNumber: int
-    RawText: str
+    pass
 
 
-@dataclass
+@dataclass(slots=True)
 class TOCCommentLine(TOCLineNode):
-    LineNumber: int
-    RawText: str
     Value: str
 
 
-@dataclass
+@dataclass(slots=True)
 class TOCFileEntryLine(TOCLineNode):
-    LineNumber: int
-    RawText: str
-    FileEntry: TOCFileEntry
+    _FileEntry: TOCFileEntry
+
+    # called when FileEntry is replaced, a TOCFile sets this on the lines its cached load plans were built from
+    OnChanged: Optional[Callable[[], None]] = field(default=None, kw_only=True, repr=False, compare=False)
+
+    def __init__(self, LineNumber: int, RawText: str, FileEntry: TOCFileEntry, *, _SourceLine: int = 0):
+        self.LineNumber = LineNumber
+        self._RawText = RawText
+        self._SourceLine = _SourceLine
+        self._FileEntry = FileEntry
+        self.OnChanged = None
+
+    @property
+    def FileEntry(self) -> TOCFileEntry:
+        return self._FileEntry
+
+    @FileEntry.setter
+    def FileEntry(self, entry: TOCFileEntry):
+        self._FileEntry = entry
+        if self.OnChanged is not None:
+            self.OnChanged()
+
 
+@dataclass(slots=True)
+class TOCRawFileEntryLine(TOCLineNode):
+    """A file entry line that has not been parsed yet, see `TOCAST.iter_nodes(defer_files=True)`"""
 
-@dataclass
+    def parse(self) -> TOCFileEntryLine:
+        node = parse_file_line(self.LineNumber, self.RawText)
+        source = self._RawText
+        if isinstance(source, TOCSource):
+            node.attach_source(source, self._SourceLine)
+
+        return node
+
+
+FILE_ENTRY_NODE_TYPES = (TOCFileEntryLine, TOCRawFileEntryLine)
+
+
+@dataclass(slots=True)
 class TOCUnrecognizedLine(TOCLineNode):
-    LineNumber: int
-    RawText: str
+    pass
 
 
-@dataclass
+@dataclass(slots=True)
 class TOCDirectiveLine(TOCLineNode):
-    LineNumber: int
-    RawText: str
     CanonicalName: str
     RawName: str
     Locale: Optional[str]
@@ -92,97 +245,60 @@ def is_extended_directive(directive_name: str) -> bool:
 
 
 def resolve_directive_name_and_locale(raw: str) -> tuple[str, Optional[str]]:
+    base, locale = raw, None
     if "-" in raw:
-        if raw.startswith("X-"):
-            parts = raw.rsplit("-", 1)
-            base, maybe_locale = parts[0], parts[1]
-            if not maybe_locale in list(TOCTextLocale):
-                base = f"{base}-{maybe_locale}"
-                locale = None
-            else:
-                locale = TOCTextLocale[maybe_locale]
-        else:
-            base, locale = raw.split("-", 1)
-    else:
-        base, locale = raw, None
+        maybe_base, maybe_locale = raw.rsplit("-", 1)
+        if maybe_locale in TEXT_LOCALES:
+            base, locale = maybe_base, TOCTextLocale(maybe_locale)
 
-    canonical = ALIAS_TO_CANONICAL.get(base.lower(), base)
+    canonical, _ = TOC_DIRECTIVE_REGISTRY.resolve(base)
     return canonical, locale
 
 
-def parse_typed_value(raw_value: str, spec: TOCDirectiveSpec):
-    _type = spec.ValueType
+def parse_typed_value(raw_value: Any, spec: TOCDirectiveSpec):
+    if isinstance(raw_value, (list, tuple, set, frozenset)):
+        raw_value = ", ".join(str(v) for v in raw_value)
+    elif not isinstance(raw_value, str):
+        raw_value = str(raw_value)
 
-    if _type is TOCBoolType:
-        val = StringToBoolean(raw_value)
-        return TOCBoolType(raw_value, val)
+    converter = spec.Converter
+    if converter is None:
+        converter = compile_value_converter(spec)
+
+    return converter(raw_value)
 
-    if _type is TOCIntValue:
-        try:
-            val = int(raw_value)
-        except ValueError:
-            raise ValueError(f"Expected integer for {spec.Name}, got: {raw_value}")
-        return TOCIntValue(raw_value, val)
-
-    if _type is TOCLocalizedDirectiveValue:
-        val = str(raw_value)
-        return TOCLocalizedDirectiveValue(val)
-
-    if get_origin(_type) is TOCListValue:
-        (list_type,) = get_args(_type)
-        values = []
-
-        if isinstance(raw_value, list_type):
-            values.append(raw_value)
-        elif isinstance(raw_value, str):
-            for v in raw_value.split(","):
-                if isinstance(v, str):
-                    v = v.strip()
-                if not isinstance(v, list_type):
-                    v = list_type(v)
-                values.append(v)
-
-        return TOCListValue[list_type](raw_value, values)
-
-    if get_origin(_type) is TOCEnumValue:
-        (enum_type,) = get_args(_type)
-        return TOCEnumValue[enum_type](raw_value, enum_type[raw_value.strip()])
-
-    if _type in CONDITION_DIRECTIVES_TO_CLASS.values():
-        if not isinstance(raw_value, list):
-            raw_value = frozenset([raw_value])
-        return _type(raw_value)
-
-    if not isinstance(raw_value, _type):
-        return _type(raw_value)
-
-    return raw_value
-
-
-def parse_directive_line(line_no: int, line: str) -> Optional[TOCDirectiveLine]:
-    name, value = line.split(": ", 1)
-    name = name.split(" ", 1)[1]
-    canonical, locale = resolve_directive_name_and_locale(name)
-    is_extended = is_extended_directive(canonical)
 
-    value.removesuffix("\n")
+def tokenize_line(line: str) -> tuple[TOCLineKind, Optional[re.Match]]:
+    """Classifies a raw TOC line. For directives, the returned match holds the 'raw', 'name', 'locale' and 'value' groups."""
+    match = _match_line(line)
+    if match is None:
+        return TOCLineKind.FileEntry, None
+
+    return LINE_TOKEN_KINDS[match.lastindex], match
+
+
+def parse_directive_line(line_no: int, line: str, match: Optional[re.Match] = None) -> Optional[TOCDirectiveLine]:
+    if match is None:
+        kind, match = tokenize_line(line)
+        if kind is not TOCLineKind.Directive:
+            raise ValueError(f"Line {line_no} is not a directive: {line!r}")
+
+    name, base, locale, value = match.group("raw", "name", "locale", "value")
+    if locale is not None and locale not in TEXT_LOCALES:
+        base, locale = name, None
+
+    canonical, spec = TOC_DIRECTIVE_REGISTRY.resolve(base)
+    is_extended = is_extended_directive(canonical)
 
     if is_extended:  # use raw value for 'X-' directives
         node = TOCLocalizedDirectiveValue(value)
         node.set_translation(locale, cleanup_text(value))
         parsed_value = node
+    elif spec is None:
+        # this is an unknown creatura
+        parsed_value = TOCUnkValue(value, cleanup_text(value))
     else:
-        spec = TOC_DIRECTIVES.get(canonical)
-        if spec is None:
-            for spec_name, func in ALIAS_FUNCTIONS.items():
-                if func(name):
-                    spec = TOC_DIRECTIVES.get(spec_name)
-
-        if spec is None:
-            # this is an unknown creatura
-            parsed_value = TOCUnkValue(value, cleanup_text(value))
-        else:
-            parsed_value = parse_typed_value(value, spec)
+        parsed_value = parse_typed_value(value, spec)
 
     return TOCDirectiveLine(
         RawText=line,
@@ -197,6 +313,16 @@ def parse_directive_line(line_no: int, line: str) -> Optional[TOCDirectiveLine]:
 
 def split_file_path_and_conditions(line: str):
     line = line.strip()
+
+    # the path ends at the first whitespace outside of brackets, when there are no brackets before it that's just the first whitespace
+    match = _find_whitespace(line)
+    if match is None:
+        return line, []
+
+    end = match.start()
+    if line.find("[", 0, end) < 0 and line.find("]", 0, end) < 0:
+        return line[:end], FILE_CONDITION_VARIABLE_PATTERN.findall(line[end:].strip())
+
     depth = 0
 
     for i, char in enumerate(line):
@@ -249,30 +375,352 @@ def parse_comment(line_no: int, line: str) -> TOCCommentLine:
     return TOCCommentLine(line_no, line, value)
 
 
-@dataclass
+def parse_line(line_no: int, raw_line: str) -> Optional[TOCLineNode]:
+    kind, match = tokenize_line(raw_line)
+    return parse_tokenized_line(line_no, raw_line, kind, match)
+
+
+def parse_tokenized_line(line_no: int, raw_line: str, kind: TOCLineKind, match: Optional[re.Match]) -> Optional[TOCLineNode]:
+    if kind is TOCLineKind.Directive:
+        return parse_directive_line(line_no, raw_line, match)
+    elif kind is TOCLineKind.FileEntry:
+        return parse_file_line(line_no, raw_line)
+    elif kind is TOCLineKind.Comment:
+        return parse_comment(line_no, raw_line)
+    else:
+        return TOCEmptyLine(line_no, raw_line)
+
+
+@dataclass(slots=True)
 class TOCAST:
     Lines: list[TOCLineNode]
+    Source: Optional[TOCSource] = field(default=None, compare=False, repr=False)  # the source that source-backed nodes point into, if any
+
+    @staticmethod
+    def iter_nodes(source: Iterable[str], start: int = 0, header_only: bool = False, defer_files: bool = False) -> Iterator[TOCLineNode]:
+        """Parses lines from any iterable of strings (i.e. an open file) and yields each node as soon as it's read.
+
+        With `header_only`, iteration stops at the first file entry line without parsing it.
+        With `defer_files`, file entry lines are yielded as unparsed TOCRawFileEntryLine nodes."""
+        for line_no, raw_line in enumerate(source, start):
+            kind, match = tokenize_line(raw_line)
+            if kind is TOCLineKind.FileEntry:
+                if header_only:
+                    return
+                elif defer_files:
+                    yield TOCRawFileEntryLine(line_no, raw_line)
+                    continue
+
+            node = parse_tokenized_line(line_no, raw_line, kind, match)
+            if node is not None:
+                yield node
+
+    @staticmethod
+    def iter_source_nodes(source: TOCSource, header_only: bool = False, defer_files: bool = False) -> Iterator[TOCLineNode]:
+        """Same as iter_nodes, but for a whole TOC file held in a TOCSource. Nodes point into the source instead of holding copies of their lines."""
+        text = source.Text
+        offsets = source.LineOffsets
+        del offsets[1:]
+
+        line_no = 0
+        start = 0
+        text_len = len(text)
+        while start < text_len:
+            end = text.find("\n", start) + 1 or text_len
+            offsets.append(end)
+            match = _match_line(text, start, end)
+
+            if match is None:
+                if header_only:
+                    return
+                elif defer_files:
+                    node = TOCRawFileEntryLine(line_no, None)
+                else:
+                    node = parse_file_line(line_no, text[start:end])
+            else:
+                kind = LINE_TOKEN_KINDS[match.lastindex]
+                if kind is TOCLineKind.Directive:
+                    node = parse_directive_line(line_no, None, match)
+                elif kind is TOCLineKind.Comment:
+                    node = parse_comment(line_no, text[start:end])
+                else:
+                    node = TOCEmptyLine(line_no, None)
+
+            node.attach_source(source, line_no)
+            yield node
+
+            line_no += 1
+            start = end
 
     @classmethod
-    def from_lines(cls, lines: List[str]):
-        toc_lines = []
-        for line_no, raw_line in enumerate(lines):
-            if is_empty(raw_line):
-                toc_lines.append(TOCEmptyLine(line_no, raw_line))
-            elif is_directive(raw_line):
-                node = parse_directive_line(line_no, raw_line)
-                if node:
-                    toc_lines.append(node)
-            elif is_comment(raw_line):
-                node = parse_comment(line_no, raw_line)
-                toc_lines.append(node)
-            else:
-                node = parse_file_line(line_no, raw_line)
-                toc_lines.append(node)
+    def from_lines(cls, lines: Iterable[str]):
+        return cls(list(cls.iter_nodes(lines)))
+
+    @classmethod
+    def from_source(cls, text: str):
+        source = TOCSource(text)
+        return cls(list(cls.iter_source_nodes(source)), source)
 
-        return cls(toc_lines)
+    @classmethod
+    def from_stream(cls, stream: TextIO):
+        return cls.from_lines(stream)
 
     @classmethod
     def empty(cls):
         lines = []
         return cls(lines)
+
+    def iter_text(self) -> Iterator[str]:
+        """Yields the text of the whole AST. Runs of untouched source-backed nodes are yielded as a single slice of the source."""
+        run_source, run_first, run_last = None, 0, 0
+        for node in self.Lines:
+            source = node._RawText
+            if isinstance(source, TOCSource):
+                if source is run_source and node._SourceLine == run_last + 1:
+                    run_last += 1
+                    continue
+
+                if run_source is not None:
+                    yield run_source.get_text(run_first, run_last)
+
+                run_source, run_first, run_last = source, node._SourceLine, node._SourceLine
+                continue
+
+            if run_source is not None:
+                yield run_source.get_text(run_first, run_last)
+                run_source = None
+
+            yield node.RawText
+
+        if run_source is not None:
+            yield run_source.get_text(run_first, run_last)
+
+
+class TOCNameTable:
+    """Interns directive names to small integer ids, so they can be stored in arrays and compared across ASTs"""
+
+    __slots__ = ("Names", "Ids")
+
+    def __init__(self):
+        self.Names: list[str] = []
+        self.Ids: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.Names)
+
+    def intern(self, name: str) -> int:
+        name_id = self.Ids.get(name)
+        if name_id is None:
+            name_id = len(self.Names)
+            self.Names.append(name)
+            self.Ids[name] = name_id
+
+        return name_id
+
+    def get_id(self, name: str) -> Optional[int]:
+        return self.Ids.get(name)
+
+    def get_name(self, name_id: int) -> str:
+        return self.Names[name_id]
+
+
+# shared by every TOCColumnarAST by default, so name ids mean the same thing across a whole corpus
+TOC_DIRECTIVE_NAME_TABLE = TOCNameTable()
+
+# locale ids stored in TOCColumnarAST.DirectiveLocales, 0 means no locale
+TEXT_LOCALE_IDS = {locale: i for i, locale in enumerate(TOCTextLocale, 1)}
+TEXT_LOCALES_BY_ID: list[Optional[TOCTextLocale]] = [None, *TOCTextLocale]
+
+
+@dataclass(slots=True)
+class TOCColumnarAST:
+    """A struct-of-arrays alternative to TOCAST, meant for bulk analytics over many TOC files.
+
+    Every line gets a TOCLineKind in `Kinds`, and line offsets live in `Source.LineOffsets`.
+    Directives additionally get an entry in each of the `Directive*` arrays, which are parallel to one another:
+    the line it's on, the id of its canonical name in `Names`, its locale id and the span of its raw value in the source.
+
+    No node objects are created until asked for with `get_node` or `to_ast`."""
+
+    Source: TOCSource = field(compare=False, repr=False)
+    Kinds: array = field(default_factory=lambda: array("B"))
+    DirectiveLines: array = field(default_factory=lambda: array("I"))
+    DirectiveNameIds: array = field(default_factory=lambda: array("I"))
+    DirectiveLocales: array = field(default_factory=lambda: array("B"))
+    DirectiveValueStarts: array = field(default_factory=lambda: array("I"))
+    DirectiveValueEnds: array = field(default_factory=lambda: array("I"))
+    Names: TOCNameTable = field(default=TOC_DIRECTIVE_NAME_TABLE, compare=False, repr=False)
+
+    @classmethod
+    def from_source(cls, text: str, header_only: bool = False, names: Optional[TOCNameTable] = None):
+        """Tokenizes a whole TOC file into arrays. With `header_only`, stops at the first file entry line."""
+        source = TOCSource(text)
+        ast = cls(source) if names is None else cls(source, Names=names)
+
+        offsets = source.LineOffsets
+        kinds = ast.Kinds
+        directive_lines = ast.DirectiveLines
+        name_ids = ast.DirectiveNameIds
+        locales = ast.DirectiveLocales
+        value_starts = ast.DirectiveValueStarts
+        value_ends = ast.DirectiveValueEnds
+        intern = ast.Names.intern
+        resolve = TOC_DIRECTIVE_REGISTRY.resolve
+
+        line_no = 0
+        start = 0
+        text_len = len(text)
+        while start < text_len:
+            end = text.find("\n", start) + 1 or text_len
+            match = _match_line(text, start, end)
+
+            if match is None:
+                if header_only:
+                    break
+
+                kind = TOCLineKind.FileEntry
+            else:
+                kind = LINE_TOKEN_KINDS[match.lastindex]
+                if kind is TOCLineKind.Directive:
+                    name, base, locale = match.group("raw", "name", "locale")
+                    if locale is not None and locale not in TEXT_LOCALES:
+                        base, locale = name, None
+
+                    directive_lines.append(line_no)
+                    name_ids.append(intern(resolve(base)[0]))
+                    locales.append(0 if locale is None else TEXT_LOCALE_IDS[locale])
+                    value_start, value_end = match.span("value")
+                    while value_end > value_start and text[value_end - 1] in "\r\n":
+                        value_end -= 1
+
+                    value_starts.append(value_start)
+                    value_ends.append(value_end)
+
+            offsets.append(end)
+            kinds.append(kind)
+            line_no += 1
+            start = end
+
+        return ast
+
+    @classmethod
+    def from_ast(cls, ast: TOCAST, names: Optional[TOCNameTable] = None):
+        return cls.from_source("".join(ast.iter_text()), names=names)
+
+    @classmethod
+    def from_file(cls, path: str, header_only: bool = False, names: Optional[TOCNameTable] = None):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_source(f.read(), header_only, names)
+
+    def __len__(self) -> int:
+        return len(self.Kinds)
+
+    def count_kind(self, kind: TOCLineKind) -> int:
+        return self.Kinds.count(kind)
+
+    def count_directive(self, name: str) -> int:
+        """Returns how many times the given directive appears, by canonical name (aliases are resolved)"""
+        name_id = self.Names.get_id(TOC_DIRECTIVE_REGISTRY.resolve(name)[0])
+        if name_id is None:
+            return 0
+
+        return self.DirectiveNameIds.count(name_id)
+
+    def count_directives(self) -> dict[str, int]:
+        """Returns a {canonical name: count} mapping of every directive in this AST"""
+        counts: dict[int, int] = {}
+        for name_id in self.DirectiveNameIds:
+            counts[name_id] = counts.get(name_id, 0) + 1
+
+        get_name = self.Names.get_name
+        return {get_name(name_id): count for name_id, count in counts.items()}
+
+    def get_directive_value(self, index: int) -> str:
+        """Returns the raw value text (without the line ending) of the directive at `index` in the Directive* arrays"""
+        return self.Source.Text[self.DirectiveValueStarts[index] : self.DirectiveValueEnds[index]]
+
+    def get_directive_locale(self, index: int) -> Optional[TOCTextLocale]:
+        return TEXT_LOCALES_BY_ID[self.DirectiveLocales[index]]
+
+    def iter_directives(self) -> Iterator[tuple[str, str]]:
+        """Yields (canonical name, raw value) for every directive, in order"""
+        get_name = self.Names.get_name
+        text = self.Source.Text
+        for name_id, start, end in zip(self.DirectiveNameIds, self.DirectiveValueStarts, self.DirectiveValueEnds):
+            yield get_name(name_id), text[start:end]
+
+    def get_node(self, line_no: int, defer_files: bool = False) -> TOCLineNode:
+        """Builds the source-backed node object for a single line. With `defer_files`, a file entry line is left as an unparsed TOCRawFileEntryLine."""
+        source = self.Source
+        kind = self.Kinds[line_no]
+        start, end = source.get_span(line_no)
+
+        if kind == TOCLineKind.Directive:
+            node = parse_directive_line(line_no, None, _match_line(source.Text, start, end))
+        elif kind == TOCLineKind.FileEntry:
+            node = TOCRawFileEntryLine(line_no, None) if defer_files else parse_file_line(line_no, source.Text[start:end])
+        elif kind == TOCLineKind.Comment:
+            node = parse_comment(line_no, source.Text[start:end])
+        else:
+            node = TOCEmptyLine(line_no, None)
+
+        node.attach_source(source, line_no)
+        return node
+
+    def iter_nodes(self, defer_files: bool = False) -> Iterator[TOCLineNode]:
+        """Builds the source-backed node of every line, in order. Lines are already classified, so only directive lines are matched again.
+
+        With `defer_files`, file entry lines are yielded as unparsed TOCRawFileEntryLine nodes."""
+        source = self.Source
+        text = source.Text
+        offsets = source.LineOffsets
+        for line_no, kind in enumerate(self.Kinds):
+            start, end = offsets[line_no], offsets[line_no + 1]
+            if kind == TOCLineKind.Directive:
+                node = parse_directive_line(line_no, None, _match_line(text, start, end))
+            elif kind == TOCLineKind.FileEntry:
+                node = TOCRawFileEntryLine(line_no, None) if defer_files else parse_file_line(line_no, text[start:end])
+            elif kind == TOCLineKind.Comment:
+                node = parse_comment(line_no, text[start:end])
+            else:
+                node = TOCEmptyLine(line_no, None)
+
+            node.attach_source(source, line_no)
+            yield node
+
+    def to_ast(self) -> TOCAST:
+        return TOCAST(list(self.iter_nodes()), self.Source)
+
+    def __reduce__(self):
+        # pickled with a list of only the names it uses, so what's sent to or from another process doesn't grow with the shared name table.
+        # it's unpickled into the shared name table of whichever process loads it. The source is pickled as is, so nodes pointing into it share it
+        old_names = self.Names.Names
+        name_ids = {name_id: i for i, name_id in enumerate(dict.fromkeys(self.DirectiveNameIds))}
+        names = [old_names[name_id] for name_id in name_ids]
+        directive_name_ids = array("I", map(name_ids.__getitem__, self.DirectiveNameIds))
+
+        arrays = (self.Kinds, self.DirectiveLines, directive_name_ids, self.DirectiveLocales, self.DirectiveValueStarts, self.DirectiveValueEnds)
+        return _restore_columnar_ast, (self.Source, arrays, names)
+
+    def rebind_names(self, names: TOCNameTable = TOC_DIRECTIVE_NAME_TABLE):
+        """Moves this AST over to another name table, remapping its name ids"""
+        if names is self.Names:
+            return
+
+        old_names = self.Names.Names
+        if len(old_names) > len(self.DirectiveNameIds):
+            # the old table is shared with other ASTs, only intern the names this one uses
+            name_ids = {name_id: names.intern(old_names[name_id]) for name_id in set(self.DirectiveNameIds)}
+        else:
+            name_ids = [names.intern(name) for name in old_names]
+
+        self.DirectiveNameIds = array("I", map(name_ids.__getitem__, self.DirectiveNameIds))
+        self.Names = names
+
+
+def _restore_columnar_ast(source: TOCSource, arrays: tuple[array, ...], names: list[str]) -> TOCColumnarAST:
+    # unpickled ASTs always join the shared name table of the process they're loaded in
+    kinds, directive_lines, directive_name_ids, directive_locales, value_starts, value_ends = arrays
+    name_ids = [TOC_DIRECTIVE_NAME_TABLE.intern(name) for name in names]
+    directive_name_ids = array("I", map(name_ids.__getitem__, directive_name_ids))
+    return TOCColumnarAST(source, kinds, directive_lines, directive_name_ids, directive_locales, value_starts, value_ends)
@@ -1,14 +1,23 @@
+import copy
+import bisect
+import itertools
+
+from functools import partial, wraps
+from contextlib import contextmanager
+
 from pathlib import Path
 from dataclasses import dataclass, field, InitVar
-from typing import Optional, Union, List, Any, get_args
+from typing import Optional, Union, List, Any, Callable, Iterable, Iterator, get_args, get_origin
 
 from .enums import *
+from .context import TOCContextKey
 from .file_entry import *
 from .parser import *
 from .shared import *
+from .export import *
 
 
-@dataclass
+@dataclass(slots=True)
 class TOCFileBinding:
     """A binding between a file and it's node in the AST"""
 
@@ -16,7 +25,7 @@ class TOCFileBinding:
     NodeIndex: int
 
 
-@dataclass
+@dataclass(slots=True)
 class TOCDirectiveBinding:
     """A binding between a given TOC directive and it's nodes in the AST"""
 
@@ -24,16 +33,102 @@ class TOCDirectiveBinding:
     NodeIndices: list[int]
 
 
+# conditions and path variables that only depend on the game type, and so can be baked into a flavor-specific TOC file
+GAME_TYPE_CONDITIONS = (TOCAllowLoadGameType, TOCExcludeLoadGameType)
+GAME_TYPE_VARIABLES = frozenset({"family", "game"})
+
+
+def get_flavor_file_name(addon_name: str, game_type: TOCGameType) -> str:
+    """Returns the name of the client-specific TOC file for the given game type, i.e. 'MyAddon_Mainline.toc'"""
+    return f"{addon_name}_{TOC_GAME_TYPE_TO_FILE_SUFFIX[game_type]}.toc"
+
+
+@dataclass(slots=True)
+class TOCEditBatch:
+    """Edits queued by TOCFile.batch(), applied in a single pass when the batch exits"""
+
+    NewDirectives: list[tuple[str, Any]] = field(default_factory=list)
+    AddedFiles: list[str] = field(default_factory=list)
+    RemovedFiles: set[int] = field(default_factory=set)
+    UpdatedFiles: dict[int, str] = field(default_factory=dict)
+    ReplacedFiles: Optional[list[str]] = None
+
+
+class TOCFileList(list):
+    """The file section of a TOCFile. Changing it in place calls `OnChanged`, which the TOCFile uses to drop its cached load plans
+    and to rebuild the file section on the next sync."""
+
+    __slots__ = ("OnChanged",)
+
+    def __init__(self, files: Iterable[TOCFileEntryLine] = (), on_changed: Optional[Callable[[], None]] = None):
+        super().__init__(files)
+        self.OnChanged = on_changed
+
+    def __reduce__(self):
+        # the default list pickling appends the items back one by one, before OnChanged is restored
+        return TOCFileList, (list(self), self.OnChanged)
+
+
+def _notify_after(method: Callable) -> Callable:
+    @wraps(method)
+    def wrapper(self: TOCFileList, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        if self.OnChanged is not None:
+            self.OnChanged()
+
+        return result
+
+    return wrapper
+
+
+for _name in ("__setitem__", "__delitem__", "__iadd__", "__imul__", "append", "extend", "insert", "pop", "remove", "clear", "sort", "reverse"):
+    setattr(TOCFileList, _name, _notify_after(getattr(list, _name)))
+
+
+@dataclass(slots=True)
+class TOCContextClass:
+    """A group of (GameType, Environment, TextLocale) combinations that all load the same files, returned by TOCFile.evaluate_matrix()"""
+
+    Contexts: list[TOCContextKey]
+    Files: tuple[str, ...]
+
+    def iter_contexts(self) -> Iterator[TOCEvaluationContext]:
+        for key in self.Contexts:
+            yield key.to_context()
+
+
 @dataclass
 class TOCFile:
     _file_path: InitVar[Optional[Union[str, Path]]] = None
-    _AST: Optional[TOCAST] = field(default=None, init=False, repr=True)
+    header_only: InitVar[bool] = False
+    _ast: Optional[TOCAST] = field(default=None, init=False, repr=True)
+
+    # loaded from a columnar AST, only the directive and comment nodes are built up front, by line number. The rest of the AST is built from both when first needed
+    _columnar: Optional[TOCColumnarAST] = field(default=None, init=False, repr=False)
+    _columnar_nodes: Optional[dict[int, TOCLineNode]] = field(default=None, init=False, repr=False)
 
     _attr_bindings: dict[str, TOCDirectiveBinding] = field(default_factory=dict, init=False, repr=False)
-    _attr_dirty: bool = field(default=False, init=False, repr=False)
+    _dirty_attrs: set[str] = field(default_factory=set, init=False, repr=False)  # names of directive attributes changed since the last sync
 
     _file_bindings: list[TOCFileBinding] = field(default_factory=list, init=False, repr=False)
     _files_dirty: bool = field(default=False, init=False, repr=False)
+    _files: TOCFileList = field(default_factory=TOCFileList, init=False, repr=False)
+
+    # resolved load plans by context key, cleared whenever the file section changes
+    _load_plans: dict[TOCContextKey, tuple[str, ...]] = field(default_factory=dict, init=False, repr=False)
+    _files_version: int = field(default=0, init=False, repr=False)
+    _files_watched: bool = field(default=False, init=False, repr=False)  # whether the lines in Files report FileEntry changes to this file, see __watch_files
+
+    # the file section is parsed the first time it's needed, until then it's either unread (header-only loads) or raw file entry nodes
+    _files_loaded: bool = field(default=True, init=False, repr=False)
+    _pending_files: list[int] = field(default_factory=list, init=False, repr=False)
+    _source_path: Optional[Path] = field(default=None, init=False, repr=False)
+    _source_lines_read: Optional[int] = field(default=None, init=False, repr=False)
+
+    _batch: Optional[TOCEditBatch] = field(default=None, init=False, repr=False)
+
+    # once cloned, AST nodes are shared with other TOCFiles, and only the nodes in here (by id) may be changed in place. None means every node is ours
+    _owned_nodes: Optional[dict[int, TOCLineNode]] = field(default=None, init=False, repr=False)
 
     _initialized: bool = field(default=False, init=False, repr=False)
 
@@ -68,21 +163,100 @@ class TOCFile:
 
     ExtendedDirectives: Optional[dict[str, str]] = field(default_factory=dict, init=False)
     UnknownDirectives: Optional[dict[str, TOCUnkValue]] = field(default_factory=dict, init=False)
-    Files: Optional[list[TOCFileEntryLine]] = field(default_factory=list, init=False)
     Comments: Optional[TOCListValue[TOCCommentLine]] = field(default_factory=list, init=False)
 
     def __set(self, name: str, value: Any):
         # using object.__setattr__ to avoid calling into our own hook uwu
         object.__setattr__(self, name, value)
 
-    def __post_init__(self, _file_path: str | Path = None):
+    def __post_init__(self, _file_path: str | Path = None, header_only: bool = False):
+        self._files.OnChanged = self.mark_files_dirty
         if _file_path is not None:
-            self.load_file(_file_path)
+            self.load_file(_file_path, header_only)
         else:
             self.setup_empty()
 
         self.__set("_initialized", True)
 
+    @classmethod
+    def from_source(cls, text: str, source_path: Optional[Union[str, Path]] = None) -> "TOCFile":
+        """Loads a TOC file from its full text, see load_source. `source_path` is where the text was read from, if anywhere.
+
+        Unlike a streamed load, the AST keeps `text` alive as a whole, but its nodes don't hold their own lines, and unchanged lines are exported straight from it."""
+        toc = cls()
+        toc.__set("_initialized", False)
+        toc.load_source(text)
+        toc.__set("_source_path", Path(source_path) if source_path is not None else None)
+        toc.__set("_initialized", True)
+        return toc
+
+    @classmethod
+    def from_columnar(cls, ast: TOCColumnarAST, source_path: Optional[Union[str, Path]] = None) -> "TOCFile":
+        """Loads a TOC file from a columnar AST of it, without classifying its lines again.
+
+        Only directive and comment lines are parsed, the AST is built when first needed and the file section when first accessed.
+        Until then, the TOCFile pickles to little more than `ast` and its directive values."""
+        toc = cls()
+        toc.__set("_initialized", False)
+
+        nodes = {}
+        for line_no, kind in enumerate(ast.Kinds):
+            if kind == TOCLineKind.FileEntry:
+                toc._pending_files.append(line_no)
+            elif kind == TOCLineKind.Directive or kind == TOCLineKind.Comment:
+                node = nodes[line_no] = ast.get_node(line_no)
+                toc.__bind_node(node, line_no)
+
+        toc.__set("_AST", None)
+        toc.__set("_columnar", ast)
+        toc.__set("_columnar_nodes", nodes)
+        toc.__set("_files_loaded", not toc._pending_files)
+        toc.__set("_source_path", Path(source_path) if source_path is not None else None)
+        toc.__set("_initialized", True)
+        return toc
+
+    @classmethod
+    def load_header(cls, file_path: Union[str, Path]) -> "TOCFile":
+        """Reads only the directives of a TOC file, stopping at the first file entry. The file section is loaded when it is first accessed."""
+        return cls(file_path, header_only=True)
+
+    @property
+    def Files(self) -> list[TOCFileEntryLine]:
+        if not self._files_loaded:
+            self.load_files()
+
+        return self._files
+
+    @Files.setter
+    def Files(self, files: list[TOCFileEntryLine]):
+        self.__set("_files", TOCFileList(files, self.mark_files_dirty))
+        self.__set("_files_loaded", True)
+        self.__set("_files_dirty", True)
+        self.invalidate_load_plans()
+
+    @property
+    def FilesLoaded(self) -> bool:
+        return self._files_loaded
+
+    @property
+    def _AST(self) -> Optional[TOCAST]:
+        if self._ast is None and self._columnar is not None:
+            self.__build_ast()
+
+        return self._ast
+
+    @_AST.setter
+    def _AST(self, ast: Optional[TOCAST]):
+        self.__set("_ast", ast)
+        self.__set("_columnar", None)
+        self.__set("_columnar_nodes", None)
+
+    def __build_ast(self):
+        # the nodes that were bound are reused, so the AST holds the very nodes in Comments and the directive attributes
+        columnar, nodes = self._columnar, self._columnar_nodes
+        lines = [nodes[line_no] if line_no in nodes else columnar.get_node(line_no, defer_files=True) for line_no in range(len(columnar.Kinds))]
+        self.__set("_AST", TOCAST(lines, columnar.Source))
+
     def __setattr__(self, name: str, value: Any):
         if not self._initialized or name.startswith("_"):
             self.__set(name, value)
@@ -92,8 +266,41 @@ class TOCFile:
         self.__set(name, value)
 
         if name in TOC_DIRECTIVES or name in CONDITION_DIRECTIVES_TO_CLASS:
+            self.__watch_value(name, value)
             if old_value != value:
-                self.__set("_attr_dirty", True)
+                self.mark_attribute_dirty(name)
+
+    def __watch_value(self, attr_name: str, value: Any):
+        if isinstance(value, TOCListValue):
+            value.OnChanged = partial(self.mark_attribute_dirty, attr_name)
+
+    def mark_attribute_dirty(self, attr_name: str):
+        """Marks a directive attribute as changed, so its lines are regenerated on the next sync. Needed after changing a value in place."""
+        self._dirty_attrs.add(attr_name)
+
+    def invalidate_load_plans(self):
+        """Drops every cached load plan. This happens on its own whenever the file section changes, be it through the editing methods,
+        `Files` or the `FileEntry` of one of its lines."""
+        self._load_plans.clear()
+        self.__set("_files_version", self._files_version + 1)
+        self.__set("_files_watched", False)
+
+    def mark_files_dirty(self):
+        """Marks the file section as changed, so it's rebuilt on the next sync. Changing `Files` in place does this for you."""
+        self.__set("_files_dirty", True)
+        self.invalidate_load_plans()
+
+    def __watch_files(self):
+        # a line's FileEntry can be replaced without going through this TOCFile, so before a plan is cached, every line is set to report it.
+        # that's only redone once the file section changes, as lines can only be added to it through a change
+        if self._files_watched:
+            return
+
+        invalidate = self.invalidate_load_plans
+        for local_file in self._files:
+            local_file.OnChanged = invalidate
+
+        self.__set("_files_watched", True)
 
     def setup_empty(self):
         ast = TOCAST.empty()
@@ -155,6 +362,7 @@ class TOCFile:
                     return
 
         self.__set(node.CanonicalName, node.Value)
+        self.__watch_value(node.CanonicalName, node.Value)
         self.__add_directive_binding(node.CanonicalName, node_index)
 
     def __regenerate_directive_line(self, node: TOCDirectiveLine) -> str:
@@ -185,71 +393,148 @@ class TOCFile:
 
         return f"{PYTOC_DIRECTIVE_PREFIX} {attr_name}: {value_str}"
 
-    def __reindex_bindings_after(self, start_index: int):
+    def __reindex_bindings_after(self, start_index: int, count: int = 1):
         for binding in self._attr_bindings.values():
-            binding.NodeIndices = [idx + 1 if idx >= start_index else idx for idx in binding.NodeIndices]
+            binding.NodeIndices = [idx + count if idx >= start_index else idx for idx in binding.NodeIndices]
+
+        self.__set("_pending_files", [idx + count if idx >= start_index else idx for idx in self._pending_files])
 
         for i, binding in enumerate(self._file_bindings):
             if binding.NodeIndex >= start_index:
-                self._file_bindings[i] = TOCFileBinding(binding.LocalFile, binding.NodeIndex + 1)
+                self._file_bindings[i] = TOCFileBinding(binding.LocalFile, binding.NodeIndex + count)
 
     def __insert_new_directive(self, attr_name: str, value: Any):
+        if self._batch is not None:
+            self._batch.NewDirectives.append((attr_name, value))
+            return
+
+        self.__insert_new_directives([(attr_name, value)])
+
+    def __insert_new_directives(self, directives: list[tuple[str, Any]]):
         insert_at = 0
         for i, node in enumerate(self._AST.Lines):
             if isinstance(node, TOCDirectiveLine):
                 insert_at = i + 1
-            elif isinstance(node, TOCFileEntryLine):
+            elif isinstance(node, FILE_ENTRY_NODE_TYPES):
                 break
 
-        new_node = TOCDirectiveLine(
-            LineNumber=insert_at,
-            RawText=self.__generate_directive_raw_text(attr_name, value),
-            CanonicalName=attr_name,
-            RawName=attr_name,
-            Value=value,
-            Locale=None,
-            IsExtendedDirective=False,
-        )
-
-        self._AST.Lines.insert(insert_at, new_node)
-        self.__add_directive_binding(attr_name, insert_at)
-        self.__reindex_bindings_after(insert_at)
-
-    def set_ast(self, ast: TOCAST, overwrite: bool = False):
+        new_nodes = [
+            TOCDirectiveLine(
+                LineNumber=line_number,
+                RawText=self.__generate_directive_raw_text(attr_name, value),
+                CanonicalName=attr_name,
+                RawName=attr_name,
+                Value=value,
+                Locale=None,
+                IsExtendedDirective=False,
+            )
+            for line_number, (attr_name, value) in enumerate(directives, insert_at)
+        ]
+
+        self.__reindex_bindings_after(insert_at, len(new_nodes))
+        self._AST.Lines[insert_at:insert_at] = new_nodes
+        for node_index, (attr_name, _) in enumerate(directives, insert_at):
+            self.__add_directive_binding(attr_name, node_index)
+
+    @contextmanager
+    def batch(self):
+        """Queues directive inserts and file edits, and applies them all at once when the outermost batch exits.
+        If the batch exits with an exception, the queued edits are discarded instead. Changes that aren't queued, like new directive values, are kept.
+
+        Inside a batch, `Files` is not updated until the batch exits. Indices given to `remove_file(s)` and `update_file_path`
+        refer to `Files` as it was when the batch started, or to the new list after `replace_files`."""
+        if self._batch is not None:
+            yield self
+            return
+
+        batch = TOCEditBatch()
+        self.__set("_batch", batch)
+        try:
+            yield self
+        finally:
+            self.__set("_batch", None)
+
+        self.__apply_batch(batch)
+
+    def __resolve_batch_index(self, index: int) -> int:
+        """Resolves a file index given inside a batch against the list it refers to, see batch()"""
+        replaced = self._batch.ReplacedFiles
+        return range(len(self.Files) if replaced is None else len(replaced))[index]
+
+    def __apply_batch(self, batch: TOCEditBatch):
+        if batch.NewDirectives:
+            self.__insert_new_directives(batch.NewDirectives)
+
+        if not (batch.AddedFiles or batch.RemovedFiles or batch.UpdatedFiles or batch.ReplacedFiles is not None):
+            return
+
+        old_files = self.Files if batch.ReplacedFiles is None else self.__files_from_paths(batch.ReplacedFiles)
+        new_files = []
+        for i, local_file in enumerate(old_files):
+            if i in batch.RemovedFiles:
+                continue
+
+            new_path = batch.UpdatedFiles.get(i)
+            new_files.append(local_file if new_path is None else self.__new_file_line(local_file.LineNumber, new_path))
+
+        line_number = new_files[-1].LineNumber + 1 if new_files else 1
+        new_files.extend(self.__new_file_line(i, file_path) for i, file_path in enumerate(batch.AddedFiles, line_number))
+
+        self.Files = new_files
+
+    def __bind_node(self, node: TOCLineNode, node_index: int):
+        if isinstance(node, TOCFileEntryLine):
+            list.append(self._files, node)  # binding isn't a change to the file section
+            self.__add_file_binding(node, node_index)
+
+        elif isinstance(node, TOCRawFileEntryLine):
+            self._pending_files.append(node_index)
+            if self._files_loaded:
+                self.__set("_files_loaded", False)
+
+        elif isinstance(node, TOCDirectiveLine):
+            self.__process_directive_line(node, node_index)
+
+        elif isinstance(node, TOCCommentLine):
+            self.Comments.append(node)
+
+    def set_ast(self, ast: Union[TOCAST, Iterable[TOCLineNode]], overwrite: bool = False):
+        """Binds the given AST to this TOCFile. Also accepts a node iterator (i.e. TOCAST.iter_nodes), in which case nodes are bound as they are parsed."""
         if self._initialized and not overwrite:
             raise Exception("Attempt to set a new AST on an initialized TOCFile. To overwrite, pass `overwrite=True` into TOCFile.set_ast().")
 
         self._attr_bindings.clear()
         self._file_bindings.clear()
+        self._pending_files.clear()
+        self.invalidate_load_plans()
 
-        for i, node in enumerate(ast.Lines):
-            if isinstance(node, TOCFileEntryLine):
-                self.Files.append(node)
-                self.__add_file_binding(node, i)
-                continue
-
-            if isinstance(node, TOCDirectiveLine):
-                self.__process_directive_line(node, i)
-
-            elif isinstance(node, TOCCommentLine):
-                self.Comments.append(node)
+        if isinstance(ast, TOCAST):
+            for i, node in enumerate(ast.Lines):
+                self.__bind_node(node, i)
+        else:
+            nodes, ast = ast, TOCAST.empty()
+            for i, node in enumerate(nodes):
+                ast.Lines.append(node)
+                self.__bind_node(node, i)
 
         self.__set("_AST", ast)
 
     def sync_attributes_to_ast(self):
-        if not self._attr_dirty:
+        """Regenerates the lines of every directive attribute changed since the last sync"""
+        if not self._dirty_attrs:
             return
 
-        for attr_name, binding in self._attr_bindings.items():
+        for attr_name in self._dirty_attrs:
+            binding = self._attr_bindings.get(attr_name)
             attr_value = getattr(self, attr_name, None)
-            if attr_value is None:
+            if binding is None or attr_value is None:
                 continue
 
             for node_idx in binding.NodeIndices:
                 if node_idx >= len(self._AST.Lines):
                     continue
 
-                node = self._AST.Lines[node_idx]
+                node = self.__own_node(node_idx)
                 if not isinstance(node, TOCDirectiveLine):
                     continue
 
@@ -275,85 +560,538 @@ class TOCFile:
                     node.Value = attr_value
                     node.RawText = self.__regenerate_directive_line(node)
 
-        self.__set("_attr_dirty", False)
+        self._dirty_attrs.clear()
 
     def rebuild_file_section(self):
-        ast = self._AST
-        indices = [i for i, n in enumerate(ast.Lines) if isinstance(n, TOCFileEntryLine)]
+        """Rebuilds the file section of the AST from `Files` in a single pass.
+
+        Files that are still bound to a line keep it, so comments and empty lines between files stay where they are.
+        Any other file is placed right after the file before it in `Files`."""
+        self.load_files()
+        lines = self._AST.Lines
+
+        bindings = {id(binding.LocalFile): binding for binding in self._file_bindings}
+        first_slot = len(lines)
+        for i, node in enumerate(lines):
+            if isinstance(node, FILE_ENTRY_NODE_TYPES):
+                first_slot = i
+                break
 
-        if not indices:
-            insert_at = len(ast.Lines)
-        else:
-            insert_at = indices[0]
-            for i in reversed(indices):
-                del ast.Lines[i]
+        # bound files stay on their line, any other file follows the bound file before it, or goes where the section starts
+        kept: dict[int, TOCFileBinding] = {}
+        followers: dict[int, list[TOCFileEntryLine]] = {}
+        last_slot = -1
+        for local_file in self.Files:
+            binding = bindings.get(id(local_file))
+            if binding is not None and binding.NodeIndex > last_slot and lines[binding.NodeIndex] is local_file:
+                kept[binding.NodeIndex] = binding
+                last_slot = binding.NodeIndex
+            else:
+                followers.setdefault(last_slot, []).append(local_file)
 
+        bound_directives = {idx for binding in self._attr_bindings.values() for idx in binding.NodeIndices}
+        remap = {}
+        new_lines = []
         new_bindings = []
 
-        for lf in self.Files:
-            node = TOCFileEntryLine(LineNumber=lf.LineNumber, RawText=lf.RawText, FileEntry=lf.FileEntry)
-            ast.Lines.insert(insert_at, node)
-            new_bindings.append(TOCFileBinding(lf, insert_at))
-            insert_at += 1
+        def place(files: list[TOCFileEntryLine]):
+            for local_file in files:
+                new_bindings.append(TOCFileBinding(local_file, len(new_lines)))
+                new_lines.append(local_file)
+
+        for i, node in enumerate(lines):
+            if i == first_slot and -1 in followers:
+                place(followers[-1])
+
+            if isinstance(node, FILE_ENTRY_NODE_TYPES):
+                binding = kept.get(i)
+                if binding is not None:
+                    binding.NodeIndex = len(new_lines)
+                    new_bindings.append(binding)
+                    new_lines.append(node)
+
+                if i in followers:
+                    place(followers[i])
+            else:
+                if i in bound_directives:
+                    remap[i] = len(new_lines)
+                new_lines.append(node)
+
+        if first_slot == len(lines) and -1 in followers:
+            place(followers[-1])
 
+        for binding in self._attr_bindings.values():
+            binding.NodeIndices = [remap[idx] for idx in binding.NodeIndices]
+
+        lines[:] = new_lines
         self.__set("_file_bindings", new_bindings)
         self.__set("_files_dirty", False)
 
     def update_file_node(self, node_index: int, local_file: TOCFileEntryLine):
-        node = self._AST.Lines[node_index]
+        node = self.__own_node(node_index)
 
         node: TOCFileEntryLine
         node.FileEntry = local_file.FileEntry
         node.RawText = local_file.RawText
+        self.invalidate_load_plans()
 
     def sync_files_to_ast(self):
         if not self._files_dirty:
             return
 
-        old_bindings = self._file_bindings
-        new_files = self.Files
+        self.rebuild_file_section()
 
-        if len(old_bindings) == len(new_files):
-            for binding, new_file in zip(old_bindings, new_files):
-                self.update_file_node(binding.NodeIndex, new_file)
-        else:
-            self.rebuild_file_section()
+    def __own_node(self, node_index: int) -> TOCLineNode:
+        """Returns the node at `node_index`, first replacing it with a private copy if it's shared with a clone"""
+        node = self._AST.Lines[node_index]
+        owned = self._owned_nodes
+        if owned is None or id(node) in owned:
+            return node
+
+        new_node = copy.copy(node)
+        owned[id(new_node)] = new_node
+        self._AST.Lines[node_index] = new_node
+
+        if isinstance(node, TOCFileEntryLine):
+            bindings = self._file_bindings
+            i = bisect.bisect_left(bindings, node_index, key=lambda binding: binding.NodeIndex)
+            if i < len(bindings) and bindings[i].LocalFile is node:
+                bindings[i].LocalFile = new_node
+
+            # the copy loads the same file, so the file section isn't changed
+            files = self._files
+            if i < len(files) and files[i] is node:
+                list.__setitem__(files, i, new_node)
+            else:
+                for i, local_file in enumerate(files):
+                    if local_file is node:
+                        list.__setitem__(files, i, new_node)
+                        break
+
+        elif isinstance(node, TOCCommentLine):
+            self.Comments[:] = [new_node if comment is node else comment for comment in self.Comments]
+
+        return new_node
+
+    def clone(self) -> "TOCFile":
+        """Returns a copy of this TOC file that shares its AST nodes with this one. Shared nodes are copied the first time either TOC file changes them.
+
+        Directive values and the lines in `Files` can be changed in place by anyone holding on to them, so those are copied right away.
+        The file section is parsed first if it hasn't been yet, so it's parsed once instead of once per clone."""
+        self.load_files()
+
+        # the file lines stay this file's own, only the clone gets copies of them
+        files = {id(local_file): copy.copy(local_file) for local_file in self._files}
+        self.__set("_owned_nodes", {id(local_file): local_file for local_file in self._files})
+
+        clone = object.__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+
+        def own(node: TOCLineNode) -> TOCLineNode:
+            return files.get(id(node), node)
+
+        clone.__set("_AST", TOCAST([own(node) for node in self._AST.Lines], self._AST.Source))
+        clone.__set("_attr_bindings", {name: TOCDirectiveBinding(name, list(b.NodeIndices)) for name, b in self._attr_bindings.items()})
+        clone.__set("_file_bindings", [TOCFileBinding(own(b.LocalFile), b.NodeIndex) for b in self._file_bindings])
+        clone.__set("_files", TOCFileList(map(own, self._files), clone.mark_files_dirty))
+        clone.__set("_load_plans", dict(self._load_plans))
+        clone.__set("_pending_files", list(self._pending_files))
+        clone.__set("_dirty_attrs", set(self._dirty_attrs))
+        clone.__set("_owned_nodes", {id(local_file): local_file for local_file in clone._files})
+        clone.__set("_batch", None)
+
+        # the copied lines still report to this file, and the clone starts out with its cached plans
+        clone.__set("_files_watched", False)
+        clone.__watch_files()
+
+        copies = {}
+
+        def copy_value(value: Any) -> Any:
+            new_value = copies.get(id(value))
+            if new_value is not None:
+                return new_value
+
+            if isinstance(value, TOCListValue):
+                new_value = copy.copy(value)
+                new_value.Value = list(value.Value)
+            elif isinstance(value, TOCLocalizedDirectiveValue):
+                new_value = copy.copy(value)
+                new_value.Localizations = dict(value.Localizations)
+            elif isinstance(value, (TOCBoolType, TOCIntValue, TOCEnumValue, TOCUnkValue)):
+                new_value = copy.copy(value)
+            else:
+                return value
 
-        self.__set("_files_dirty", False)
+            copies[id(value)] = new_value
+            return new_value
+
+        for name, value in self.__dict__.items():
+            if not name.startswith("_"):
+                clone.__set(name, copy_value(value))
+                clone.__watch_value(name, clone.__dict__[name])
+
+        clone.__set("Comments", list(self.Comments))
+        clone.__set("ExtendedDirectives", {name: copy_value(value) for name, value in self.ExtendedDirectives.items()})
+        clone.__set("UnknownDirectives", {name: copy_value(value) for name, value in self.UnknownDirectives.items()})
+
+        return clone
 
     def sync_all(self):
+        # a header-only TOCFile has to read the rest of its source first, or it would be synced (and exported) without its file section
+        self.__read_remaining_lines()
         self.sync_attributes_to_ast()
         self.sync_files_to_ast()
 
-    def load_file(self, file_path: Union[str | Path]):
+    def load_file(self, file_path: Union[str | Path], header_only: bool = False):
         if not isinstance(file_path, Path):
             file_path = Path(file_path)
 
         if not file_path.exists():
             raise FileNotFoundError(f"TOC file does not exist at the given path: '{file_path}'")
 
+        # streamed, so the file is never held in memory as a whole. See from_source for source-backed loading
         with open(file_path, encoding="utf-8") as f:
-            lines = f.readlines()
+            self.load_stream(f, header_only)
 
-        ast = TOCAST.from_lines(lines)
-        self.set_ast(ast)
+        self.__set("_source_path", file_path)
 
-    def export(self, export_path: Union[str | Path], overwrite: bool = False):
+    def load_source(self, text: str):
+        """Loads a whole TOC file from a string, the AST nodes share `text` instead of copying their lines out of it"""
+        source = TOCSource(text)
+        self.set_ast(TOCAST.iter_source_nodes(source, defer_files=True))
+        self._AST.Source = source
+
+    def load_stream(self, stream: Iterable[str], header_only: bool = False):
+        if not header_only:
+            self.set_ast(TOCAST.iter_nodes(stream, defer_files=True))
+            return
+
+        self.set_ast(TOCAST.iter_nodes(stream, header_only=True))
+        self.__set("_files_loaded", False)
+        self.__set("_source_lines_read", len(self._AST.Lines))
+
+    def load_files(self):
+        """Parses the file section, reading the rest of the source file first if this TOCFile was loaded with `header_only=True`"""
+        if self._files_loaded:
+            return
+
+        self.__read_remaining_lines()
+        self.__materialize_files()
+        self.__set("_files_loaded", True)
+
+    def __read_remaining_lines(self):
+        """Reads the lines a header-only load stopped at into the AST, leaving file entries unparsed"""
+        if self._source_lines_read is None:
+            return
+
+        if self._source_path is None:
+            raise Exception("Unable to load the file section of a header-only TOCFile that was not loaded from a file.")
+
+        with open(self._source_path, encoding="utf-8") as f:
+            remaining = itertools.islice(f, self._source_lines_read, None)
+            for node in TOCAST.iter_nodes(remaining, start=self._source_lines_read, defer_files=True):
+                node_index = len(self._AST.Lines)
+                self._AST.Lines.append(node)
+                self.__bind_node(node, node_index)
+
+        self.__set("_source_lines_read", None)
+
+    def __materialize_files(self):
+        # files are parsed through the list methods directly, as parsing them doesn't change the file section
+        lines = self._AST.Lines
+        files = self._files
+        bindings = self._file_bindings
+        for node_index in self._pending_files:
+            node = lines[node_index] = lines[node_index].parse()
+            list.append(files, node)
+            bindings.append(TOCFileBinding(node, node_index))
+
+        if self._pending_files and len(files) > len(self._pending_files):
+            # files were bound from both parsed and raw nodes, put them back in source order
+            self._file_bindings.sort(key=lambda binding: binding.NodeIndex)
+            list.__setitem__(files, slice(None), [binding.LocalFile for binding in self._file_bindings])
+
+        self._pending_files.clear()
+
+    def __reparse_node(self, node: TOCLineNode) -> TOCLineNode:
+        new_node = parse_line(node.LineNumber, node.RawText)
+        source = node.get_source()
+        if source is not None:
+            new_node.attach_source(source, node._SourceLine)
+
+        return new_node
+
+    def __reset_directive_attribute(self, node: TOCDirectiveLine):
+        if node.IsExtendedDirective or isinstance(node.Value, TOCUnkValue):
+            self.ExtendedDirectives.pop(node.RawName, None)
+            self.UnknownDirectives.pop(node.CanonicalName, None)
+            self.__dict__.pop(node.CanonicalName, None)
+        else:
+            self.__set(node.CanonicalName, None)
+
+    def reparse_range(self, start_line: int, end_line: int, new_lines: Iterable[str]):
+        """Replaces lines `start_line` up to (but not including) `end_line` with `new_lines`, and only reparses those.
+
+        `new_lines` should keep their line endings, as returned by `str.splitlines(keepends=True)`.
+        Bindings, `Files`, `Comments` and the attributes of any directive that appears in the old or new lines are patched in place.
+        Unsynced changes are synced to the AST first, so line numbers refer to the AST as it would be exported."""
         self.sync_all()
+        self.load_files()
 
-        if not isinstance(export_path, Path):
-            export_path = Path(export_path)
+        lines = self._AST.Lines
+        if not 0 <= start_line <= end_line <= len(lines):
+            raise IndexError(f"Invalid line range {start_line}-{end_line} for a TOC file with {len(lines)} lines")
 
-        if export_path.exists() and not overwrite:
-            raise FileExistsError(f"File already exists at the provided export path. To overwrite, pass `overwrite=True` into TOCFile.Export().")
+        old_nodes = lines[start_line:end_line]
+        new_nodes = list(TOCAST.iter_nodes(new_lines, start=start_line))
+        new_end = start_line + len(new_nodes)
+        delta = len(new_nodes) - len(old_nodes)
 
-        text = "".join(node.RawText for node in self._AST.Lines)
-        with open(export_path, "w", encoding="utf-8", newline="") as f:
-            f.write(text)
+        lines[start_line:end_line] = new_nodes
+        if delta != 0:
+            for node_index in range(new_end, len(lines)):
+                self.__own_node(node_index).LineNumber += delta
+
+        # directives that were removed or added get their attributes rebuilt from all of their remaining nodes
+        affected = {}
+        for node in itertools.chain(old_nodes, new_nodes):
+            if isinstance(node, TOCDirectiveLine):
+                affected.setdefault(node.RawName if node.IsExtendedDirective else node.CanonicalName, [])
+
+        for node in old_nodes:
+            if isinstance(node, TOCDirectiveLine):
+                self.__reset_directive_attribute(node)
+
+        for attr_name, binding in list(self._attr_bindings.items()):
+            indices = [idx if idx < start_line else idx + delta for idx in binding.NodeIndices if not start_line <= idx < end_line]
+            if attr_name in affected:
+                del self._attr_bindings[attr_name]
+                affected[attr_name].extend(indices)
+            else:
+                binding.NodeIndices = indices
+
+        for i, node in enumerate(new_nodes, start_line):
+            if isinstance(node, TOCDirectiveLine):
+                affected[node.RawName if node.IsExtendedDirective else node.CanonicalName].append(i)
+
+        for attr_name, indices in affected.items():
+            indices = affected[attr_name] = sorted(set(indices))
+            for idx in indices:
+                if idx < start_line or idx >= new_end:
+                    # list values of earlier nodes were extended in place by later ones, start over from the line itself
+                    lines[idx] = self.__reparse_node(lines[idx])
+                    self.__reset_directive_attribute(lines[idx])
+
+        for indices in affected.values():
+            for idx in indices:
+                self.__process_directive_line(lines[idx], idx)
+
+        bindings = self._file_bindings
+        lo = bisect.bisect_left(bindings, start_line, key=lambda binding: binding.NodeIndex)
+        hi = bisect.bisect_left(bindings, end_line, key=lambda binding: binding.NodeIndex)
+        for binding in itertools.islice(bindings, hi, None):
+            binding.NodeIndex += delta
+
+        new_bindings = [TOCFileBinding(node, i) for i, node in enumerate(new_nodes, start_line) if isinstance(node, TOCFileEntryLine)]
+        bindings[lo:hi] = new_bindings
+        list.__setitem__(self._files, slice(lo, hi), [binding.LocalFile for binding in new_bindings])  # already in sync with the AST
+        if lo != hi or new_bindings:
+            self.invalidate_load_plans()
+
+        if any(isinstance(node, TOCCommentLine) for node in itertools.chain(old_nodes, new_nodes)):
+            self.Comments[:] = [node for node in lines if isinstance(node, TOCCommentLine)]
+
+    def export(self, export_path: Union[str | Path], overwrite: bool = False, atomic: bool = False) -> bool:
+        """Writes this TOC file to `export_path`, returning True if the file was written.
+
+        With `atomic`, the file is written to a temporary file and renamed into place, and is left untouched (mtime included) if it already holds the same content."""
+        self.sync_all()
+        return write_toc_text(export_path, self._AST.iter_text(), overwrite, atomic)
 
     def get_all_addon_file_names(self) -> List[str]:
         return [f.FileEntry.export() for f in self.Files]
 
+    def should_load_files(self, ctx: TOCEvaluationContext) -> list[bool]:
+        """Evaluates the load conditions of every file against the given context in one call, returning whether each one should load"""
+        return evaluate_file_entries((local_file.FileEntry for local_file in self.Files), ctx)
+
+    def get_files_to_load(self, ctx: TOCEvaluationContext) -> list[TOCFileEntry]:
+        """Returns the file entries that should load in the given context, in load order"""
+        entries = [local_file.FileEntry for local_file in self.Files]
+        return [entry for entry, should_load in zip(entries, evaluate_file_entries(entries, ctx)) if should_load]
+
+    def load_plan(self, ctx: Union[TOCEvaluationContext, TOCContextKey]) -> tuple[str, ...]:
+        """Returns the resolved paths of the files that load in the given context, in load order.
+
+        Plans are cached per context key, until the file section changes."""
+        files = self.Files
+        key = TOCContextKey.of(ctx)
+        plans = self._load_plans
+        plan = plans.get(key)
+        if plan is None:
+            self.__watch_files()
+            entries = [local_file.FileEntry for local_file in files]
+            plan = tuple(entry.resolve_path(key) for entry, should_load in zip(entries, evaluate_file_entries(entries, key)) if should_load)
+            plans[key] = plan
+
+        return plan
+
+    def iter_load_plan(self, ctx: Union[TOCEvaluationContext, TOCContextKey]) -> Iterator[str]:
+        """Lazily yields the resolved paths of the files that load in the given context, in load order.
+
+        Uses the cached plan if there is one, and caches the plan it builds if it's read to the end without the file section changing."""
+        files = self.Files
+        key = TOCContextKey.of(ctx)
+        plan = self._load_plans.get(key)
+        if plan is not None:
+            yield from plan
+            return
+
+        self.__watch_files()
+        version = self._files_version
+        paths = []
+        for local_file in files:
+            entry = local_file.FileEntry
+            if entry.should_load(key):
+                path = entry.resolve_path(key)
+                paths.append(path)
+                yield path
+
+        if version == self._files_version:
+            self._load_plans[key] = tuple(paths)
+
+    def evaluate_matrix(
+        self,
+        game_types: Optional[Iterable[TOCGameType]] = None,
+        environments: Optional[Iterable[TOCEnvironment]] = None,
+        text_locales: Optional[Iterable[TOCTextLocale]] = None,
+    ) -> list[TOCContextClass]:
+        """Groups every combination of game type, environment and text locale (all of them by default) by the files that load in it.
+
+        Combinations are grouped by what the file section can tell apart: the distinct load conditions of its files, and the path variables they use.
+        Files are then only resolved once per group, and the load plan cache is filled in for every combination."""
+        files = self.Files
+        game_types = list(TOCGameType if game_types is None else game_types)
+        environments = list(TOCEnvironment if environments is None else environments)
+        text_locales = list(TOCTextLocale if text_locales is None else text_locales)
+
+        # one entry per distinct set of conditions is enough to tell combinations apart
+        masks: dict[int, TOCFileEntry] = {}
+        uncompiled: dict[tuple, TOCFileEntry] = {}
+        variables = set()
+        for local_file in files:
+            entry = local_file.FileEntry
+            if entry.ConditionMask is None:
+                uncompiled.setdefault(entry.Conditions or (), entry)
+            elif entry.ConditionMask != CONDITION_MASK_ALL:
+                masks.setdefault(entry.ConditionMask, entry)
+
+            variables.update(entry.get_path_variables())
+
+        uncompiled = list(uncompiled.values())
+        uses_game = "game" in variables
+        uses_family = "family" in variables and not uses_game
+        uses_locale = "textlocale" in variables
+
+        groups: dict[tuple, list[TOCContextKey]] = {}
+        for game_type, environment, text_locale in itertools.product(game_types, environments, text_locales):
+            ctx = TOCContextKey.get(game_type, environment, text_locale)
+            key = get_condition_key(ctx)
+            if key is not None and not uncompiled:
+                loads = tuple(mask & key == key for mask in masks)
+            else:
+                loads = tuple(entry.should_load(ctx) for entry in itertools.chain(masks.values(), uncompiled))
+
+            signature = (
+                loads,
+                game_type if uses_game else None,
+                ctx.Family if uses_family else None,
+                text_locale if uses_locale else None,
+            )
+            groups.setdefault(signature, []).append(ctx)
+
+        # different signatures can still resolve to the same files, i.e. the same path listed under two different conditions
+        classes: dict[tuple[str, ...], TOCContextClass] = {}
+        for contexts in groups.values():
+            plan = self.load_plan(contexts[0])
+            context_class = classes.get(plan)
+            if context_class is None:
+                context_class = classes[plan] = TOCContextClass(contexts, plan)
+            else:
+                context_class.Contexts.extend(contexts)
+
+            for ctx in contexts:
+                self._load_plans[ctx] = context_class.Files
+
+        return list(classes.values())
+
+    def specialize(self, targets: Union[TOCEvaluationContext, TOCGameType, Iterable[Union[TOCEvaluationContext, TOCGameType]]]) -> dict[TOCGameType, "TOCFile"]:
+        """Creates a flavor-specific TOC file for each target, keyed by game type. Each one is a clone of this TOC file with its file section resolved:
+        files that can't load are dropped, path variables are substituted and the conditions that were evaluated are stripped.
+
+        For a game type, only game type conditions and the [Family] and [Game] variables are resolved, everything else is kept as is.
+        For an evaluation context, everything is resolved against it.
+
+        The file section is walked once for all targets, and each distinct set of conditions and path is only evaluated once per target."""
+        if isinstance(targets, (TOCEvaluationContext, TOCGameType)):
+            targets = (targets,)
+
+        contexts: list[tuple[TOCEvaluationContext, bool]] = []
+        for target in targets:
+            if isinstance(target, TOCEvaluationContext):
+                contexts.append((target, True))
+            else:
+                contexts.append((TOCEvaluationContext(TOCGameType(target), TOCEnvironment.Global, PYTOC_DEFAULT_LOCALE), False))
+
+        game_types = [ctx.GameType for ctx, _ in contexts]
+        if len(set(game_types)) != len(game_types):
+            raise ValueError(f"Only one target per game type can be specialized at once: {game_types}")
+
+        # for each distinct (path, conditions), the file line each target gets, or None if it doesn't load there
+        resolved: dict[tuple, list[Optional[TOCFileEntryLine]]] = {}
+        variant_files: list[list[TOCFileEntryLine]] = [[] for _ in contexts]
+
+        for local_file in self.Files:
+            entry = local_file.FileEntry
+            conditions = entry.Conditions or ()
+            if not conditions and "[" not in entry.RawFilePath:
+                for files in variant_files:
+                    files.append(local_file)
+                continue
+
+            key = (entry.RawFilePath, conditions)
+            lines = resolved.get(key)
+            if lines is None:
+                lines = resolved[key] = [self.__specialize_file_entry(local_file, ctx, full) for ctx, full in contexts]
+
+            for files, line in zip(variant_files, lines):
+                if line is not None:
+                    files.append(line)
+
+        variants = {}
+        for game_type, files in zip(game_types, variant_files):
+            variant = self.clone()
+            variant.Files = files
+            variants[game_type] = variant
+
+        return variants
+
+    @staticmethod
+    def __specialize_file_entry(local_file: TOCFileEntryLine, ctx: TOCEvaluationContext, full: bool) -> Optional[TOCFileEntryLine]:
+        entry = local_file.FileEntry
+        conditions = entry.Conditions or ()
+        if full:
+            evaluated, kept = conditions, []
+        else:
+            evaluated = [c for c in conditions if isinstance(c, GAME_TYPE_CONDITIONS)]
+            kept = [c for c in conditions if not isinstance(c, GAME_TYPE_CONDITIONS)]
+
+        if not all(condition.evaluate(ctx) for condition in evaluated):
+            return None
+
+        new_entry = TOCFileEntry(entry.resolve_path(ctx, None if full else GAME_TYPE_VARIABLES), kept or None)
+        return TOCFileEntryLine(local_file.LineNumber, new_entry.export() + "\n", FileEntry=new_entry)
+
     def can_load_addon(self, context: TOCEvaluationContext) -> tuple[bool, TOCAddonLoadError]:
         if self.Dependencies is not None and len(self.Dependencies) > 0:
             deps_fulfilled = True
@@ -393,41 +1131,78 @@ class TOCFile:
 
         attr: TOCListValue
         attr.append(dep_name, dep_name)
-        self.__set("_attr_dirty", True)
+        self.mark_attribute_dirty(attr_name)
+
+    def __new_file_line(self, line_number: int, file_path: str) -> TOCFileEntryLine:
+        if not file_path.endswith("\n"):
+            file_path += "\n"
+
+        return parse_file_line(line_number, file_path)
 
     def update_file_path(self, index: int, new_path: str):
-        local_file = self.Files[index]
-        new_file = parse_file_line(local_file.LineNumber, new_path)
+        if self._batch is not None:
+            self._batch.UpdatedFiles[self.__resolve_batch_index(index)] = new_path
+            return
 
-        del self.Files[index]
-        self.Files.insert(index, new_file)
+        files = self.Files
+        files[index] = self.__new_file_line(files[index].LineNumber, new_path)
 
         self.__set("_files_dirty", True)
+        self.invalidate_load_plans()
 
     def add_file(self, file_path: str):
-        if not self.Files:
-            line_number = 1
-        else:
-            last_line_number = self.Files[-1].LineNumber
-            line_number = last_line_number + 1
+        self.add_files((file_path,))
 
-        if not file_path.endswith("\n"):
-            file_path += "\n"
+    def add_files(self, file_paths: Iterable[str]):
+        if self._batch is not None:
+            self._batch.AddedFiles.extend(file_paths)
+            return
 
-        new_file = parse_file_line(line_number, file_path)
-        self.Files.append(new_file)
+        files = self.Files
+        line_number = files[-1].LineNumber + 1 if files else 1
+        files.extend(self.__new_file_line(i, file_path) for i, file_path in enumerate(file_paths, line_number))
 
         self.__set("_files_dirty", True)
+        self.invalidate_load_plans()
 
     def remove_file(self, index: int):
+        if self._batch is not None:
+            self._batch.RemovedFiles.add(self.__resolve_batch_index(index))
+            return
+
         del self.Files[index]
-        del self._file_bindings[index]
 
         self.__set("_files_dirty", True)
+        self.invalidate_load_plans()
+
+    def remove_files(self, indices: Iterable[int]):
+        if self._batch is not None:
+            self._batch.RemovedFiles.update({self.__resolve_batch_index(i) for i in indices})
+            return
+
+        files = self.Files
+        valid_indices = range(len(files))
+        removed = {valid_indices[i] for i in indices}
+        self.Files = [local_file for i, local_file in enumerate(files) if i not in removed]
+
+    def replace_files(self, file_paths: Iterable[str]):
+        """Replaces every file entry with the given paths. Inside a batch, this also drops any file edits queued before it."""
+        if self._batch is not None:
+            self._batch.ReplacedFiles = list(file_paths)
+            self._batch.AddedFiles.clear()
+            self._batch.RemovedFiles.clear()
+            self._batch.UpdatedFiles.clear()
+            return
+
+        self.Files = self.__files_from_paths(file_paths)
+
+    def __files_from_paths(self, file_paths: Iterable[str]) -> list[TOCFileEntryLine]:
+        files = self.Files
+        line_number = files[0].LineNumber if files else 1
+        return [self.__new_file_line(i, file_path) for i, file_path in enumerate(file_paths, line_number)]
 
     def set_directive(self, directive: str, value: Any):
-        canonical_name = ALIAS_TO_CANONICAL.get(directive.lower())
-        spec = TOC_DIRECTIVES.get(canonical_name, None)
+        canonical_name, spec = TOC_DIRECTIVE_REGISTRY.resolve(directive)
         if spec is None:
             print("SPEC IS NONE! BARK BARK BARK")
             return
@@ -449,7 +1224,8 @@ class TOCFile:
 
         self.__insert_new_directive(directive, value)
         self.__set(canonical_name, node)
-        self.__set("_attr_dirty", True)
+        self.__watch_value(canonical_name, node)
+        self.mark_attribute_dirty(canonical_name)
 
     def add_empty_line(self):
         line_number = len(self._AST.Lines) + 1
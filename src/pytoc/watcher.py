@@ -0,0 +1,363 @@
+import os
+import sys
+import errno
+import ctypes
+import logging
+import select
+import struct
+import threading
+
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Union, Optional, Callable
+
+from .enums import *
+from .toc import TOCFile
+from .corpus import TOCCorpus, TOCAddon, TOCAddonFile, scan_addons, find_addon, parse_addon_file
+
+WATCHER_POLL_INTERVAL = 1.0
+
+_logger = logging.getLogger(__name__)
+
+# see inotify(7)
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+
+_INOTIFY_ROOT_MASK = _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_ONLYDIR
+_INOTIFY_ADDON_MASK = _IN_CLOSE_WRITE | _IN_ATTRIB | _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR
+_INOTIFY_EVENT = struct.Struct("iIII")
+_INOTIFY_READ_SIZE = 1 << 16
+
+
+@dataclass(slots=True)
+class TOCChangeEvent:
+    """A .toc file that was added, changed or removed. `Old` and `New` are the file before and after the change, and are None for added and removed files respectively."""
+
+    Kind: TOCChangeKind
+    AddonName: str
+    Path: Path
+    Old: Optional[TOCAddonFile] = None
+    New: Optional[TOCAddonFile] = None
+
+    @property
+    def OldTOC(self) -> Optional[TOCFile]:
+        return self.Old.TOC if self.Old is not None else None
+
+    @property
+    def NewTOC(self) -> Optional[TOCFile]:
+        return self.New.TOC if self.New is not None else None
+
+
+class _Inotify:
+    """A minimal inotify binding through ctypes, Linux only"""
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError(errno.ENOSYS, "inotify is not available in this libc")
+
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+
+        fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self.fd = fd
+        self.Paths: dict[int, Path] = {}
+        self._watches: dict[Path, int] = {}
+
+    def add_watch(self, path: Path, mask: int):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(path))
+
+        self.Paths[wd] = path
+        self._watches[path] = wd
+
+    def remove_watch(self, path: Path):
+        wd = self._watches.pop(path, None)
+        if wd is not None:
+            self.Paths.pop(wd, None)
+            self._rm_watch(self.fd, wd)  # fails harmlessly if the kernel already dropped it
+
+    def is_watched(self, path: Path) -> bool:
+        return path in self._watches
+
+    def wait(self, timeout: float) -> bool:
+        """Waits up to `timeout` seconds for events to be queued, returning whether there are any"""
+        return bool(select.select([self.fd], [], [], timeout)[0])
+
+    def read(self) -> list[tuple[Optional[Path], int, str]]:
+        """Returns every queued event as (watched path, mask, name), without waiting for any"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, _INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset : offset + name_length].rstrip(b"\0"))
+                offset += name_length
+
+                path = self.Paths.get(wd)
+                if mask & _IN_IGNORED:
+                    self._watches.pop(self.Paths.pop(wd, None), None)
+
+                events.append((path, mask, name))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class TOCCorpusWatcher:
+    """Keeps a TOCCorpus up to date with the .toc files under its root, re-parsing only the files that were added, changed or removed.
+
+    Changes are picked up with inotify on Linux, and by checking the size and mtime of every .toc file everywhere else (or if inotify can't be used).
+    Call poll() to check for changes, or start() to check from a background thread. Subscribers get a TOCChangeEvent for every change,
+    from whichever thread found it. An exception raised by a subscriber is logged and kept in `LastError`, the others are still notified."""
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        corpus: Optional[TOCCorpus] = None,
+        jobs: Optional[int] = None,
+        use_inotify: Optional[bool] = None,
+        poll_interval: float = WATCHER_POLL_INTERVAL,
+    ):
+        self.Corpus = corpus if corpus is not None else scan_addons(root, jobs)
+        self.Root = self.Corpus.Root
+        self.PollInterval = poll_interval
+        self.LastError: Optional[Exception] = None
+
+        self._subscribers: list[Callable[[TOCChangeEvent], None]] = []
+        self._lock = threading.RLock()  # reentrant, as subscribers are notified with it held and may well poll() themselves
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # unchanged files are told apart by these, the inode catches files replaced by a rename
+        self._stats: dict[Path, Optional[tuple[int, int, int]]] = {f.Path: self.__stat(f.Path) for f in self.Corpus.iter_files()}
+
+        self._inotify: Optional[_Inotify] = None
+        if use_inotify is not False:
+            try:
+                self._inotify = _Inotify()
+                self.__watch_tree()
+            except OSError:
+                # i.e. not on Linux, or out of watches (see /proc/sys/fs/inotify/max_user_watches)
+                if self._inotify is not None:
+                    self._inotify.close()
+                    self._inotify = None
+
+                if use_inotify:
+                    raise
+
+    def __enter__(self) -> "TOCCorpusWatcher":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def UsingInotify(self) -> bool:
+        return self._inotify is not None
+
+    def subscribe(self, callback: Callable[[TOCChangeEvent], None]) -> Callable[[], None]:
+        """Calls `callback` with every change found from now on. Returns a function that unsubscribes it."""
+        self._subscribers.append(callback)
+        return lambda: self.unsubscribe(callback)
+
+    def unsubscribe(self, callback: Callable[[TOCChangeEvent], None]):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    @staticmethod
+    def __stat(path: Path) -> Optional[tuple[int, int, int]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def __watch_tree(self):
+        self._inotify.add_watch(self.Root, _INOTIFY_ROOT_MASK)
+        with os.scandir(self.Root) as folders:
+            for folder in folders:
+                if folder.is_dir():
+                    self.__watch_folder(Path(folder.path))
+
+    def __watch_folder(self, folder: Path):
+        if self._inotify.is_watched(folder):
+            return
+
+        try:
+            self._inotify.add_watch(folder, _INOTIFY_ADDON_MASK)
+        except FileNotFoundError:
+            pass  # already gone again
+
+    def __get_all_folders(self) -> set[Path]:
+        folders = {addon.Directory for addon in self.Corpus}
+        try:
+            with os.scandir(self.Root) as entries:
+                folders.update(Path(entry.path) for entry in entries if entry.is_dir())
+        except FileNotFoundError:
+            pass
+
+        return folders
+
+    def __read_changed_folders(self) -> set[Path]:
+        """Turns queued inotify events into the set of addon folders that need to be checked"""
+        folders = set()
+        for path, mask, name in self._inotify.read():
+            if mask & _IN_Q_OVERFLOW:
+                # events were dropped, check everything
+                for folder in self.__get_all_folders():
+                    self.__watch_folder(folder)
+                    folders.add(folder)
+
+            elif path == self.Root:
+                if name and mask & _IN_ISDIR:
+                    folder = self.Root / name
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        self.__watch_folder(folder)
+                    else:
+                        self._inotify.remove_watch(folder)
+
+                    folders.add(folder)
+
+            elif path is not None:
+                if not name or name.lower().endswith(".toc"):
+                    folders.add(path)
+
+        return folders
+
+    def __update_folder(self, folder: Path) -> list[TOCChangeEvent]:
+        name = folder.name
+        addon = self.Corpus.Addons.get(name)
+        old_files = {f.Path: f for f in addon.Files} if addon is not None else {}
+        found = find_addon(folder)
+        new_files = {f.Path: f for f in found.Files} if found is not None else {}
+
+        events = []
+        for path, old_file in old_files.items():
+            if path not in new_files:
+                self._stats.pop(path, None)
+                events.append(TOCChangeEvent(TOCChangeKind.Removed, name, path, old_file, None))
+
+        for path, new_file in new_files.items():
+            old_file = old_files.get(path)
+            stat = self.__stat(path)
+            if old_file is not None and stat == self._stats.get(path):
+                new_files[path] = old_file
+                continue
+
+            # stat is taken before parsing, so a write that lands during the parse is seen as another change
+            self._stats[path] = stat
+            try:
+                new_file.AST = parse_addon_file(path)
+            except Exception as e:
+                new_file.Error = e
+
+            kind = TOCChangeKind.Added if old_file is None else TOCChangeKind.Changed
+            events.append(TOCChangeEvent(kind, name, path, old_file, new_file))
+
+        if new_files:
+            if addon is None:
+                addon = self.Corpus.Addons[name] = TOCAddon(name, folder)
+
+            addon.Files = list(new_files.values())
+        elif addon is not None:
+            del self.Corpus.Addons[name]
+
+        return events
+
+    def poll(self, timeout: float = 0) -> list[TOCChangeEvent]:
+        """Checks for changes once, updating the corpus and notifying subscribers. Returns the changes found.
+
+        With inotify, this waits up to `timeout` seconds for a change. Without it, every .toc file is checked right away."""
+        inotify = self._inotify
+        if inotify is not None and timeout > 0:
+            # waited on without the lock, so a poll that's waiting (i.e. the background thread's) doesn't hold up any other
+            inotify.wait(timeout)
+
+        # changes are applied and subscribers notified under the lock, so subscribers see them in the order they were applied
+        with self._lock:
+            if inotify is not None:
+                folders = self.__read_changed_folders()
+            else:
+                folders = self.__get_all_folders()
+
+            events = []
+            for folder in sorted(folders):
+                events.extend(self.__update_folder(folder))
+
+            for event in events:
+                for callback in list(self._subscribers):
+                    try:
+                        callback(event)
+                    except Exception as e:
+                        # a failing subscriber shouldn't keep the other subscribers, or the events after this one, from being notified
+                        self.LastError = e
+                        _logger.exception("TOCCorpusWatcher subscriber %r failed on a change to '%s'", callback, event.Path)
+
+        return events
+
+    def __run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll(self.PollInterval if self._inotify is not None else 0)
+            except Exception as e:
+                # keep watching, i.e. a folder that can't be read right now may well be readable on the next poll
+                self.LastError = e
+
+            if self._inotify is None:
+                self._stop.wait(self.PollInterval)
+
+    def start(self):
+        """Starts checking for changes from a background thread"""
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.__run, name="TOCCorpusWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        self.stop()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
@@ -1,5 +1,13 @@
 import os
+import time
+import pickle
 import pytest
+import threading
+import pytoc.cache
+import pytoc.corpus
+import pytoc.export
+import pytoc.parser
+import pytoc.directives
 
 from pathlib import Path
 
@@ -87,6 +95,709 @@ def test_parser():
     assert file.Category.get_translation("zhTW") == "角色扮演"
 
 
+def test_stream_parser():
+    with open(WORKING_DIRECTORY / "testfile.toc", encoding="utf-8") as f:
+        lines = f.readlines()
+
+    with open(WORKING_DIRECTORY / "testfile.toc", encoding="utf-8") as f:
+        ast = TOCAST.from_stream(f)
+
+    expected = TOCAST.from_lines(lines)
+    assert [(type(n), n.LineNumber, n.RawText) for n in ast.Lines] == [(type(n), n.LineNumber, n.RawText) for n in expected.Lines]
+
+    nodes = TOCAST.iter_nodes(iter(lines))
+    first = next(nodes)
+    assert isinstance(first, TOCDirectiveLine) and first.CanonicalName == "Interface"
+
+    with open(WORKING_DIRECTORY / "testfile.toc", encoding="utf-8") as f:
+        toc = TOCFile()
+        toc.set_ast(TOCAST.iter_nodes(f), overwrite=True)
+
+    assert len(toc._AST.Lines) == len(lines)
+    assert toc.Title == "GhostTools"
+
+
+def test_tokenizer():
+    assert tokenize_line("\n")[0] == TOCLineKind.Empty
+    assert tokenize_line("# a comment\n")[0] == TOCLineKind.Comment
+    assert tokenize_line("## not a directive\n")[0] == TOCLineKind.Comment
+    assert tokenize_line("Core/Global.lua\n") == (TOCLineKind.FileEntry, None)
+
+    kind, match = tokenize_line("## Title-frFR: GrasTools\n")
+    assert kind == TOCLineKind.Directive
+    assert match.group("raw", "name", "locale", "value") == ("Title-frFR", "Title", "frFR", "GrasTools\n")
+
+    kind, match = tokenize_line("## X-Website: https://ghst.tools\n")
+    assert match.group("name", "locale", "value") == ("X-Website", None, "https://ghst.tools\n")
+
+    node = parse_line(0, "## Notes:\n")
+    assert isinstance(node, TOCDirectiveLine) and node.CanonicalName == "Notes"
+
+
+def test_directive_registry(monkeypatch):
+    assert TOC_DIRECTIVE_REGISTRY.resolve("RequiredDeps") == ("Dependencies", TOC_DIRECTIVES["Dependencies"])
+    assert TOC_DIRECTIVE_REGISTRY.resolve("DepsFoo") == ("Dependencies", TOC_DIRECTIVES["Dependencies"])
+    assert TOC_DIRECTIVE_REGISTRY.resolve("savedvariables")[0] == "SavedVariables"
+    assert TOC_DIRECTIVE_REGISTRY.resolve("Vendor-Thing") == ("Vendor-Thing", None)
+    assert resolve_directive_name_and_locale("X-Category-deDE") == ("X-Category", TOCTextLocale.deDE)
+
+    node = parse_line(0, "## VendorDirective: 1, 2\n")
+    assert isinstance(node.Value, TOCUnkValue)
+
+    # registered in a copy of the registry, so the vendor directive doesn't leak into other tests
+    registry = TOCDirectiveRegistry(dict(TOC_DIRECTIVES), dict(ALIAS_TO_CANONICAL), dict(ALIAS_FUNCTIONS))
+    monkeypatch.setattr(pytoc.directives, "TOC_DIRECTIVE_REGISTRY", registry)
+    monkeypatch.setattr(pytoc.parser, "TOC_DIRECTIVE_REGISTRY", registry)
+
+    register_directive(TOCDirectiveSpec(Name="VendorDirective", ValueType=TOCListValue[int], Aliases=("VendorAlias",), AliasPrefixes=("VendorPrefix",)))
+    for line in ("## VendorDirective: 1, 2\n", "## VendorAlias: 1, 2\n", "## vendorprefixfoo: 1, 2\n"):
+        node = parse_line(0, line)
+        assert node.CanonicalName == "VendorDirective"
+        assert node.Value.Value == [1, 2]
+
+    monkeypatch.undo()
+    assert "VendorDirective" not in TOC_DIRECTIVES
+    assert isinstance(parse_line(0, "## VendorDirective: 1, 2\n").Value, TOCUnkValue)
+
+
+def test_value_converters():
+    interface = parse_typed_value("110000, 11507\n", TOC_DIRECTIVES["Interface"])
+    assert interface.Value == [110000, 11507]
+
+    saved_vars = parse_typed_value("GhostConfig,GhostData\n", TOC_DIRECTIVES["SavedVariables"])
+    assert saved_vars.Value == ["GhostConfig", "GhostData"]
+
+    assert parse_typed_value("on\n", TOC_DIRECTIVES["LoadOnDemand"]).Value
+    assert not parse_typed_value("0\n", TOC_DIRECTIVES["LoadOnDemand"]).Value
+
+    allow_load = parse_typed_value("Glue, Global\n", TOC_DIRECTIVES["AllowLoad"])
+    assert allow_load == TOCAllowLoad(frozenset({"Glue", "Global"}))
+
+    spec = TOCDirectiveSpec(Name="Build", ValueType=TOCIntValue)
+    assert parse_typed_value("1234\n", spec).Value == 1234
+    with pytest.raises(ValueError):
+        parse_typed_value("abc", spec)
+
+
+def test_header_only():
+    full = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    header = TOCFile.load_header(WORKING_DIRECTORY / "testfile.toc")
+
+    assert not header.FilesLoaded
+    assert len(header._AST.Lines) < len(full._AST.Lines)
+    assert header.Interface == full.Interface
+    assert header.Title == "GhostTools"
+    assert header.Category.get_translation("deDE") == "Rollenspiel"
+    assert header.SavedVariables == full.SavedVariables
+    assert header.ExtendedDirectives.get("X-Website") == "https://ghst.tools"
+
+    assert header.get_all_addon_file_names() == full.get_all_addon_file_names()
+    assert header.FilesLoaded
+    assert [n.RawText for n in header._AST.Lines] == [n.RawText for n in full._AST.Lines]
+
+
+def test_header_only_export(tmp_path):
+    source = WORKING_DIRECTORY / "testfile.toc"
+    header = TOCFile.load_header(source)
+    header.export(tmp_path / "header.toc")
+    assert (tmp_path / "header.toc").read_text(encoding="utf-8") == source.read_text(encoding="utf-8")
+
+    header = TOCFile.load_header(source)
+    header.Notes = "Edited"
+    notes = "## Notes: A collection of cadaverous tools for the discerning necromancer.\n"
+    assert render_toc(header) == source.read_text(encoding="utf-8").replace(notes, "## Notes: Edited\n")
+    assert len(header.Files) == 20
+
+
+def test_lazy_file_section(tmp_path):
+    toc = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    assert not toc.FilesLoaded
+    assert not any(isinstance(node, TOCFileEntryLine) for node in toc._AST.Lines)
+
+    # exporting an untouched file section shouldn't need to parse it
+    toc.export(tmp_path / "lazy.toc")
+    assert not toc.FilesLoaded
+    assert (tmp_path / "lazy.toc").read_text(encoding="utf-8") == (WORKING_DIRECTORY / "testfile.toc").read_text(encoding="utf-8")
+
+    assert len(toc.Files) == 20
+    assert toc.FilesLoaded
+    assert not any(isinstance(node, TOCRawFileEntryLine) for node in toc._AST.Lines)
+    assert [toc._AST.Lines[b.NodeIndex] for b in toc._file_bindings] == toc.Files
+    assert toc.Files[-1].FileEntry.Conditions == (TOCAllowLoadGameType(frozenset({"classic"})),)
+
+
+def test_source_backed_ast(tmp_path):
+    source = (WORKING_DIRECTORY / "testfile.toc").read_text(encoding="utf-8")
+    ast = TOCAST.from_source(source)
+
+    assert all(node.is_source_backed() for node in ast.Lines)
+    assert "".join(node.RawText for node in ast.Lines) == source
+    assert list(ast.iter_text()) == [source]
+
+    ast.Lines[1].RawText = "## Title: Ghostier Tools\n"
+    assert not ast.Lines[1].is_source_backed()
+    assert "".join(ast.iter_text()) == source.replace("## Title: GhostTools\n", "## Title: Ghostier Tools\n")
+    assert len(list(ast.iter_text())) == 3
+
+    # loading from a path streams the file instead
+    assert not any(node.is_source_backed() for node in TOCFile(WORKING_DIRECTORY / "testfile.toc")._AST.Lines)
+
+    toc = TOCFile.from_source(source, WORKING_DIRECTORY / "testfile.toc")
+    assert toc._AST.Source.Text == source
+    toc.export(tmp_path / "source.toc")
+    assert (tmp_path / "source.toc").read_text(encoding="utf-8") == source
+
+
+def test_slotted_nodes():
+    import copy
+    import pickle
+
+    toc = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    for node in (*toc._AST.Lines, toc.Files[0].FileEntry, toc.Interface, toc._file_bindings[0]):
+        assert not hasattr(node, "__dict__")
+
+    clone = pickle.loads(pickle.dumps(toc))
+    assert [node.RawText for node in clone._AST.Lines] == [node.RawText for node in toc._AST.Lines]
+    assert copy.deepcopy(toc).Files == toc.Files
+
+
+def test_columnar_ast():
+    source = (WORKING_DIRECTORY / "testfile.toc").read_text(encoding="utf-8")
+    columnar = TOCColumnarAST.from_source(source)
+    ast = TOCAST.from_source(source)
+
+    assert len(columnar) == len(ast.Lines)
+    assert columnar.count_kind(TOCLineKind.FileEntry) == len([node for node in ast.Lines if isinstance(node, TOCFileEntryLine)])
+    assert columnar.count_directive("Category") == 12
+    assert columnar.count_directive("DepsFoo") == columnar.count_directives()["Dependencies"]
+    assert next(columnar.iter_directives()) == ("Interface", "110000, 110105, 11507, 30404, 40402, 50500")
+    assert columnar.get_directive_locale(2) == TOCTextLocale.frFR
+
+    as_nodes = columnar.to_ast()
+    assert [(type(node), node.LineNumber, node.RawText) for node in as_nodes.Lines] == [(type(node), node.LineNumber, node.RawText) for node in ast.Lines]
+    assert TOCColumnarAST.from_ast(as_nodes) == columnar
+
+    header = TOCColumnarAST.from_source(source, header_only=True)
+    assert header.count_kind(TOCLineKind.FileEntry) == 0
+    assert header.DirectiveNameIds == columnar.DirectiveNameIds
+
+
+def test_reparse_range(tmp_path):
+    path = WORKING_DIRECTORY / "testfile.toc"
+    lines = path.read_text(encoding="utf-8").splitlines(keepends=True)
+    title_line = lines.index("## Title: GhostTools\n")
+    first_file = next(i for i, line in enumerate(lines) if line.startswith("Libs/"))
+
+    toc = TOCFile(path)
+    toc.reparse_range(title_line, title_line + 1, ["## Title: Ghostier Tools\n", "## SavedVariables: GhostExtra\n"])
+    toc.reparse_range(first_file + 1, first_file + 1, ["Extra.lua\n", "# an extra comment\n"])
+
+    lines[title_line : title_line + 1] = ["## Title: Ghostier Tools\n", "## SavedVariables: GhostExtra\n"]
+    lines[first_file + 1 : first_file + 1] = ["Extra.lua\n", "# an extra comment\n"]
+    expected = TOCFile()
+    expected.set_ast(TOCAST.from_lines(lines), overwrite=True)
+
+    assert toc.Title.get_translation(TOCTextLocale.enUS) == "Ghostier Tools"
+    assert toc.SavedVariables.Value == expected.SavedVariables.Value
+    assert "GhostExtra" in toc.SavedVariables
+    assert toc.Files == expected.Files
+    assert toc.Comments == expected.Comments
+    assert [toc._AST.Lines[b.NodeIndex] for b in toc._file_bindings] == toc.Files
+    assert {name: sorted(set(b.NodeIndices)) for name, b in toc._attr_bindings.items()} == {
+        name: sorted(set(b.NodeIndices)) for name, b in expected._attr_bindings.items()
+    }
+
+    toc.export(tmp_path / "reparsed.toc")
+    assert (tmp_path / "reparsed.toc").read_text(encoding="utf-8") == "".join(lines)
+
+
+def test_dirty_attributes():
+    toc = TOCFile.from_source((WORKING_DIRECTORY / "testfile.toc").read_text(encoding="utf-8"))
+    assert not toc._dirty_attrs
+
+    toc.Version = TOCLocalizedDirectiveValue("2")
+    toc.add_dependency("Blizzard_Dragon", required=True)
+    toc.SavedVariables.append("GhostExtra", "GhostExtra")
+    assert toc._dirty_attrs == {"Version", "Dependencies", "SavedVariables"}
+
+    toc.sync_all()
+    assert not toc._dirty_attrs
+
+    changed = {node.CanonicalName for node in toc._AST.Lines if isinstance(node, TOCDirectiveLine) and not node.is_source_backed()}
+    assert changed == {"Version", "Dependencies", "SavedVariables"}
+    assert toc.SavedVariables.Raw == "GhostConfig, GhostData, GhostScanData, GhostSavedProfile, GhostExtra\n"
+
+
+def test_batch():
+    toc = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    files = [f.FileEntry.RawFilePath for f in toc.Files]
+    lines = len(toc._AST.Lines)
+
+    with toc.batch():
+        toc.add_dependency("Blizzard_Dragon", required=True)
+        toc.set_directive("LoadOnDemand", 1)
+        toc.set_directive("LoadWith", ["Blizzard_Dragon"])
+        toc.remove_file(0)
+        toc.update_file_path(2, "Dragon.lua\n")
+        toc.add_file("Whelp.lua")
+
+        assert len(toc._AST.Lines) == lines
+        assert [f.FileEntry.RawFilePath for f in toc.Files] == files
+
+    assert len(toc._AST.Lines) == lines + 2
+    for name in ("LoadOnDemand", "LoadWith"):
+        (node_index,) = toc._attr_bindings[name].NodeIndices
+        assert toc._AST.Lines[node_index].CanonicalName == name
+
+    assert [f.FileEntry.RawFilePath for f in toc.Files] == [files[1], "Dragon.lua", *files[3:], "Whelp.lua"]
+
+    # indices after replace_files refer to the new list
+    replaced = [f"F{i}.lua" for i in range(30)]
+    with toc.batch():
+        toc.replace_files(replaced)
+        toc.update_file_path(25, "Dragon.lua")
+        toc.remove_file(-1)
+        toc.remove_files([0, -2])
+        with pytest.raises(IndexError):
+            toc.remove_file(30)
+
+    assert [f.FileEntry.RawFilePath for f in toc.Files] == [*replaced[1:25], "Dragon.lua", *replaced[26:28]]
+
+    # a batch that raises applies nothing
+    text = render_toc(toc)
+    with pytest.raises(RuntimeError):
+        with toc.batch():
+            toc.remove_file(0)
+            toc.add_file("Egg.lua")
+            raise RuntimeError
+
+    assert toc._batch is None
+    assert render_toc(toc) == text
+
+
+def test_bulk_file_editing(tmp_path):
+    toc = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    files = [f.FileEntry.RawFilePath for f in toc.Files]
+    others = [node.RawText for node in toc._AST.Lines if not isinstance(node, TOCFileEntryLine)]
+
+    toc.remove_files([0, 2, -1])
+    toc.add_files(["Dragon.lua", "Whelp.lua\n"])
+    toc.update_file_path(0, "Egg.lua")
+    expected = ["Egg.lua", *files[3:-1], "Dragon.lua", "Whelp.lua"]
+    assert [f.FileEntry.RawFilePath for f in toc.Files] == expected
+
+    toc.sync_all()
+    lines = toc._AST.Lines
+    assert [node for node in lines if isinstance(node, TOCFileEntryLine)] == toc.Files
+    assert [lines[b.NodeIndex] for b in toc._file_bindings] == toc.Files
+    assert [node.RawText for node in lines if not isinstance(node, TOCFileEntryLine)] == others
+    for name, binding in toc._attr_bindings.items():
+        assert all(isinstance(lines[i], TOCDirectiveLine) for i in binding.NodeIndices)
+
+    toc.replace_files(["Only.lua"])
+    toc.export(tmp_path / "replaced.toc")
+    exported = TOCFile(tmp_path / "replaced.toc")
+    assert [f.FileEntry.RawFilePath for f in exported.Files] == ["Only.lua"]
+
+
+def test_atomic_export(tmp_path):
+    toc = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    path = tmp_path / "atomic.toc"
+
+    assert toc.export(path, atomic=True)
+    assert path.read_bytes() == (WORKING_DIRECTORY / "testfile.toc").read_bytes()
+
+    os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+    with pytest.MonkeyPatch.context() as mp:
+        # an unchanged file is only compared against, nothing is written
+        mp.setattr(pytoc.export, "create_temp_file", None)
+        assert not toc.export(path, overwrite=True, atomic=True)
+    assert path.stat().st_mtime_ns == 1_000_000_000
+
+    # a prefix or an extension of the file isn't mistaken for it
+    text = path.read_text(encoding="utf-8")
+    for new_text in (text[:-1], text + "\n", text[:10] + "#" + text[11:]):
+        assert write_text_atomic(path, iter(new_text.splitlines(keepends=True)))
+        assert path.read_text(encoding="utf-8") == new_text
+    write_text_atomic(path, [text])
+    os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+
+    toc.Version = TOCLocalizedDirectiveValue("2")
+    assert toc.export(path, overwrite=True, atomic=True)
+    assert path.stat().st_mtime_ns != 1_000_000_000
+    assert TOCFile(path).Version == "2"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["atomic.toc"]
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_export_many(tmp_path, use_processes):
+    source = WORKING_DIRECTORY / "testfile.toc"
+    tocs = [TOCFile(source) for _ in range(4)]
+    tocs[1].Version = TOCLocalizedDirectiveValue("2")
+
+    paths = [tmp_path / f"Addon{i}.toc" for i in range(3)] + [tmp_path / "missing" / "Addon3.toc"]
+    results = export_many(zip(tocs, paths), jobs=2, use_processes=use_processes)
+
+    assert [result.Path for result in results] == paths
+    assert [result.Success for result in results] == [True, True, True, False]
+    assert isinstance(results[3].Error, FileNotFoundError)
+    assert paths[0].read_bytes() == source.read_bytes()
+    assert TOCFile(paths[1]).Version == "2"
+
+    results = export_many(zip(tocs[:3], paths[:3]), overwrite=True, atomic=True, use_processes=use_processes)
+    assert [result.Written for result in results] == [False, False, False]
+
+
+def test_clone(tmp_path):
+    source = WORKING_DIRECTORY / "testfile.toc"
+    toc = TOCFile(source)
+    variant = toc.clone()
+    assert all(a is b for a, b in zip(toc._AST.Lines, variant._AST.Lines) if not isinstance(a, TOCFileEntryLine))
+    assert not any(a is b for a, b in zip(toc.Files, variant.Files))
+    assert [f.FileEntry for f in variant.Files] == [f.FileEntry for f in toc.Files]
+
+    # the lines in Files are the clone's own, editing them in place leaves the original alone
+    original_text = toc.Files[0].RawText
+    variant.Files[0].FileEntry = TOCFileEntry("Edited.lua")
+    variant.Files[0].RawText = "Edited.lua\n"
+    assert toc.Files[0].FileEntry != variant.Files[0].FileEntry and toc.Files[0].RawText == original_text
+    assert variant.load_plan(TOCContextKey.get(TOCGameType.Mainline, TOCEnvironment.Global, TOCTextLocale.enUS))[0] == "Edited.lua"
+
+    variant.Version = TOCLocalizedDirectiveValue("2")
+    variant.SavedVariables.append("GhostExtra", "GhostExtra")
+    variant.remove_file(0)
+    variant.export(tmp_path / "variant.toc")
+
+    assert "GhostExtra" not in toc.SavedVariables
+    assert len(toc.Files) == len(variant.Files) + 1
+    toc.export(tmp_path / "original.toc")
+    assert (tmp_path / "original.toc").read_bytes() == source.read_bytes()
+
+    exported = TOCFile(tmp_path / "variant.toc")
+    assert exported.Version == "2"
+    assert "GhostExtra" in exported.SavedVariables
+    assert [f.FileEntry for f in exported.Files] == [f.FileEntry for f in toc.Files[1:]]
+
+    original_nodes = {id(node) for node in toc._AST.Lines}
+    unshared = [node for node in variant._AST.Lines if id(node) not in original_nodes and not isinstance(node, TOCFileEntryLine)]
+    assert {node.RawName for node in unshared} == {"Version", "SavedVariables"}
+
+
+def test_specialize(tmp_path):
+    toc = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    deDE = TOCEvaluationContext(TOCGameType.Vanilla, TOCEnvironment.Global, TOCTextLocale.deDE)
+    variants = toc.specialize([TOCGameType.Mainline, TOCGameType.Classic, deDE])
+    assert list(variants) == [TOCGameType.Mainline, TOCGameType.Classic, TOCGameType.Vanilla]
+
+    paths = {game_type: [f.FileEntry.RawFilePath for f in variant.Files] for game_type, variant in variants.items()}
+    assert "ClassicOnly.lua" not in paths[TOCGameType.Mainline]
+    assert "ClassicOnly.lua" in paths[TOCGameType.Classic]
+    assert "Mainline/FamilyFile.lua" in paths[TOCGameType.Mainline]
+    assert "classic/UIKerning.lua" in paths[TOCGameType.Classic]
+    assert "Classic/FamilyFile.lua" in paths[TOCGameType.Vanilla]
+    assert len(toc.Files) == len(paths[TOCGameType.Classic])
+
+    name = get_flavor_file_name("GhostTools", TOCGameType.Classic)
+    assert name == "GhostTools_Classic.toc"
+    assert TOC_FILE_SUFFIX_TO_GAME_TYPE["classic"] == TOCGameType.Classic
+    variants[TOCGameType.Classic].export(tmp_path / name)
+    exported = TOCFile(tmp_path / name)
+    assert exported.Title == toc.Title
+    assert all(not f.FileEntry.Conditions for f in exported.Files)
+    assert "[" not in "".join(f.FileEntry.RawFilePath for f in exported.Files)
+
+    with pytest.raises(ValueError):
+        toc.specialize([TOCGameType.Mainline, TOCGameType.Mainline])
+
+
+def test_condition_masks():
+    classic = TOCAllowLoadGameType(frozenset({"classic", "vanilla"}))
+    glue = TOCExcludeLoadEnvironment(frozenset({"Glue"}))
+    entry = TOCFileEntry("Classic.lua", [classic, glue])
+    assert entry.ConditionMask == compile_condition(classic) & compile_condition(glue)
+    assert entry.Conditions == (classic, glue)
+    with pytest.raises(AttributeError):
+        entry.Conditions.append(glue)  # the mask can't go stale
+    assert TOCFileEntry("Plain.lua").ConditionMask == CONDITION_MASK_ALL
+
+    for game_type in TOCGameType:
+        for environment in TOCEnvironment:
+            for locale in TOCTextLocale:
+                ctx = TOCEvaluationContext(game_type, environment, locale)
+                assert entry.should_load(ctx) == (classic.evaluate(ctx) and glue.evaluate(ctx))
+
+    toc = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    mainline = TOCEvaluationContext(TOCGameType.Mainline, TOCEnvironment.Global, TOCTextLocale.enUS)
+    results = toc.should_load_files(mainline)
+    assert results == [f.FileEntry.should_load(mainline) for f in toc.Files]
+    assert "ClassicOnly.lua" not in [f.RawFilePath for f in toc.get_files_to_load(mainline)]
+
+
+def test_load_plan():
+    toc = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    classic = TOCEvaluationContext(TOCGameType.Classic, TOCEnvironment.Global, TOCTextLocale.enUS)
+    plan = toc.load_plan(classic)
+    assert isinstance(plan, tuple)
+    assert plan == tuple(f.FileEntry.resolve_path(classic) for f in toc.Files if f.FileEntry.should_load(classic))
+    assert "Classic/FamilyFile.lua" in plan and "ClassicOnly.lua" in plan
+    assert toc.load_plan(TOCEvaluationContext(TOCGameType.Classic, TOCEnvironment.Global, TOCTextLocale.enUS)) is plan
+    assert tuple(toc.iter_load_plan(classic)) == plan
+
+    toc.add_file("Extra.lua")
+    assert toc.load_plan(classic) == plan + ("Extra.lua",)
+    toc.remove_file(0)
+    assert toc.load_plan(classic) == plan[1:] + ("Extra.lua",)
+
+    variant = toc.clone()
+    variant.update_file_path(0, "Renamed.lua")
+    assert variant.load_plan(classic)[0] == "Renamed.lua"
+    assert toc.load_plan(classic)[0] == plan[1]
+
+    mainline = TOCEvaluationContext(TOCGameType.Mainline, TOCEnvironment.Global, TOCTextLocale.enUS)
+    assert next(toc.iter_load_plan(mainline)) == toc.Files[0].FileEntry.RawFilePath
+    assert tuple(toc.iter_load_plan(mainline)) == toc.load_plan(mainline)
+
+    # changing the file section in place drops the cached plans too
+    plan = toc.load_plan(classic)
+    toc.Files.append(TOCFileEntryLine(0, "InPlace.lua\n", TOCFileEntry("InPlace.lua")))
+    assert toc.load_plan(classic) == plan + ("InPlace.lua",)
+    del toc.Files[0]
+    assert toc.load_plan(classic) == plan[1:] + ("InPlace.lua",)
+    toc.Files[0].FileEntry = TOCFileEntry("Edited.lua")
+    assert toc.load_plan(classic)[0] == "Edited.lua"
+    assert tuple(toc.iter_load_plan(classic)) == toc.load_plan(classic)
+
+    # only the plans of the file the line belongs to are dropped, clones included
+    plan = toc.load_plan(classic)
+    variant = toc.clone()
+    assert variant.load_plan(classic) is plan
+    variant.Files[-1].FileEntry = TOCFileEntry("Last.lua")
+    assert variant.load_plan(classic)[-1] == "Last.lua"
+    assert toc.load_plan(classic) is plan
+    assert "InPlace.lua\n" in render_toc(toc)
+
+    unpickled = pickle.loads(pickle.dumps(toc))
+    unpickled.Files.pop()
+    assert "InPlace.lua" not in unpickled.load_plan(classic)
+    assert "InPlace.lua" in toc.load_plan(classic)
+
+
+def test_evaluate_matrix():
+    toc = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    toc.add_files(["Glue.lua [AllowLoad Glue]", "Locale_[TextLocale].lua [AllowLoadTextLocale deDE, frFR]"])
+    classes = toc.evaluate_matrix()
+
+    seen = set()
+    for context_class in classes:
+        for ctx in context_class.iter_contexts():
+            expected = tuple(f.FileEntry.resolve_path(ctx) for f in toc.Files if f.FileEntry.should_load(ctx))
+            assert context_class.Files == expected
+            assert toc.load_plan(ctx) is context_class.Files
+            seen.add((ctx.GameType, ctx.Environment, ctx.TextLocale))
+
+    assert len(seen) == len(TOCGameType) * len(TOCEnvironment) * len(TOCTextLocale)
+    assert len({context_class.Files for context_class in classes}) == len(classes)
+
+    mainline = toc.evaluate_matrix(game_types=[TOCGameType.Mainline], text_locales=[TOCTextLocale.enUS, TOCTextLocale.enGB])
+    assert sorted(len(context_class.Contexts) for context_class in mainline) == [2, 4]
+
+
+def test_path_templates():
+    entry = TOCFileEntry("[Family]/[game]_[TextLocale].lua")
+    assert entry.PathSegments == ("", "Family", "/", "game", "_", "TextLocale", ".lua")
+    assert TOCFileEntry("Core/Global.lua").PathSegments is None
+
+    ctx = TOCEvaluationContext(TOCGameType.Vanilla, TOCEnvironment.Global, TOCTextLocale.deDE)
+    assert entry.resolve_path(ctx) == "Classic/vanilla_deDE.lua"
+    assert entry.resolve_path(ctx, {"family"}) == "Classic/[game]_[TextLocale].lua"
+    assert get_path_variable_table(ctx) is get_path_variable_table(TOCEvaluationContext(TOCGameType.Vanilla, TOCEnvironment.Glue, TOCTextLocale.deDE))
+
+    with pytest.raises(KeyError):
+        TOCFileEntry("[Unknown]/File.lua").resolve_path(ctx)
+
+
+def test_context_key():
+    key = TOCContextKey.get(TOCGameType.Vanilla, TOCEnvironment.Global, TOCTextLocale.enUS)
+    assert TOCContextKey.get(TOCGameType.Vanilla, TOCEnvironment.Global, TOCTextLocale.enUS) is key
+    assert key.Family == TOCFamily.Classic
+    assert pickle.loads(pickle.dumps(key)) is key
+    with pytest.raises(AttributeError):
+        key.GameType = TOCGameType.Mainline
+
+    ctx = key.to_context()
+    ctx.load_addon("GhostTools")
+    assert ctx.Key is key
+    assert TOCContextKey.of(ctx) is key and TOCContextKey.of(key) is key
+    assert not key.to_context().is_addon_loaded("GhostTools")
+
+    toc = TOCFile(WORKING_DIRECTORY / "testfile.toc")
+    assert toc.load_plan(key) is toc.load_plan(ctx)
+    assert {key: True}[ctx.Key]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_scan_addons(tmp_path, jobs):
+    addons = tmp_path / "Interface" / "AddOns"
+    source = (WORKING_DIRECTORY / "testfile.toc").read_text(encoding="utf-8")
+    for name, file_names in {
+        "GhostTools": ["GhostTools.toc", "GhostTools_Mainline.toc", "GhostTools-Vanilla.toc", "Other.toc", "GhostTools_Unknown.toc"],
+        "Broken": ["Broken.toc", "Broken_Classic.toc"],
+        "NotAnAddon": ["README.md"],
+    }.items():
+        (addons / name).mkdir(parents=True)
+        for file_name in file_names:
+            (addons / name / file_name).write_text(source, encoding="utf-8")
+
+    (addons / "Broken" / "Broken_Classic.toc").write_bytes(b"## Title: \xff\xfe\n")
+
+    corpus = scan_addons(tmp_path, jobs=jobs)
+    assert corpus.Root == addons
+    assert sorted(addon.Name for addon in corpus) == ["Broken", "GhostTools"]
+    assert "NotAnAddon" not in corpus
+
+    ghost_tools = corpus["GhostTools"]
+    # only the cheap columnar AST comes back from a scan, TOCFiles are built when first read
+    assert all(f._TOC is None and f.AST is not None for f in corpus.iter_files() if f.Success)
+    assert {f.Path.name: f.GameType for f in ghost_tools.Files} == {
+        "GhostTools.toc": None,
+        "GhostTools_Mainline.toc": TOCGameType.Mainline,
+        "GhostTools-Vanilla.toc": TOCGameType.Vanilla,
+    }
+    assert ghost_tools.get_file(TOCGameType.Mainline).Path.name == "GhostTools_Mainline.toc"
+    assert ghost_tools.get_file(TOCGameType.Wrath).Path.name == "GhostTools.toc"
+    assert ghost_tools.get_toc(TOCGameType.Vanilla).Title == "GhostTools"
+    assert ghost_tools.Files[0].AST.count_directive("Title") == TOCColumnarAST.from_source(source).count_directive("Title")
+
+    assert [(f.Path.name, type(f.Error)) for f in corpus.Errors] == [("Broken_Classic.toc", UnicodeDecodeError)]
+    assert corpus["Broken"].get_toc() is not None
+
+
+def test_parse_cache(tmp_path, monkeypatch):
+    path = tmp_path / "GhostTools" / "GhostTools.toc"
+    path.parent.mkdir()
+    path.write_bytes((WORKING_DIRECTORY / "testfile.toc").read_bytes())
+
+    with TOCParseCache(tmp_path / "cache") as cache:
+        first = cache.load_toc(path)
+
+        # a cached file is neither read nor tokenized again, and only its directives are parsed until more is needed
+        def fail(*args, **kwargs):
+            raise AssertionError("a cached file was parsed")
+
+        monkeypatch.setattr(TOCColumnarAST, "from_source", fail)
+        monkeypatch.setattr(pytoc.parser, "parse_file_line", fail)
+        cached = cache.load_toc(path)
+        assert (cache.Hits, cache.Misses) == (1, 1)
+        assert cached is not first and cached.Title == first.Title and cached.Interface == first.Interface
+        assert not cached.FilesLoaded and cached._ast is None
+        monkeypatch.undo()
+
+        assert [f.FileEntry for f in cached.Files] == [f.FileEntry for f in first.Files]
+        assert [node.RawText for node in cached._AST.Lines] == [node.RawText for node in first._AST.Lines]
+        assert all(node.is_source_backed() for node in cached._AST.Lines)
+        assert cache.load_columnar(path) == TOCColumnarAST.from_file(path)
+
+        path.write_text(path.read_text(encoding="utf-8") + "Extra.lua\n", encoding="utf-8")
+        assert cache.load_toc(path).Files[-1].FileEntry.RawFilePath == "Extra.lua"
+        assert cache.Misses == 2
+
+        monkeypatch.setattr(pytoc.cache, "CACHE_FORMAT", "old")
+        cache.load_toc(path)
+        assert cache.Misses == 3
+        monkeypatch.undo()
+
+        # an entry that can't be unpickled is a miss, and is dropped
+        cache.load_toc(path)
+        cache._connection.execute("UPDATE entries SET data = substr(data, 1, 100)")
+        size = cache.Size
+        assert cache.get(path, CACHE_KIND_COLUMNAR) is None and len(cache) == 0 and cache.Size < size
+        assert cache.load_toc(path).Title == "GhostTools" and len(cache) == 1
+
+    with TOCParseCache(tmp_path / "cache") as cache:
+        assert len(cache) == 1
+        # load_toc and scan_addons share their entries
+        scan_addons(tmp_path, jobs=1, cache=cache)
+        corpus = scan_addons(tmp_path, jobs=1, cache=cache)
+        assert cache.Hits == 2
+        assert corpus["GhostTools"].get_toc().Files[-1].FileEntry.RawFilePath == "Extra.lua"
+
+        # a warm scan doesn't read the file again
+        def fail(*args, **kwargs):
+            raise AssertionError("a cached file was parsed")
+
+        monkeypatch.setattr(pytoc.corpus, "parse_addon_file", fail)
+        corpus = scan_addons(tmp_path, jobs=1, cache=cache)
+        toc = corpus["GhostTools"].get_toc()
+        assert not corpus.Errors and cache.Hits == 3
+        assert toc.Files[-1].FileEntry.RawFilePath == "Extra.lua" and toc.Title == "GhostTools"
+        monkeypatch.undo()
+
+        cache.MaxBytes = cache.Size * 2 - 1
+        cache.put(path, "other", cache.load_columnar(path))
+        assert cache.Size <= cache.MaxBytes and len(cache) == 1
+
+
+@pytest.mark.parametrize("use_inotify", [False, True])
+def test_corpus_watcher(tmp_path, use_inotify, caplog):
+    source = (WORKING_DIRECTORY / "testfile.toc").read_text(encoding="utf-8")
+    for name in ("GhostTools", "Removed"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / f"{name}.toc").write_text(source, encoding="utf-8")
+
+    try:
+        watcher = TOCCorpusWatcher(tmp_path, jobs=1, use_inotify=use_inotify)
+    except OSError:
+        pytest.skip("inotify is not available")
+
+    def fail(event: TOCChangeEvent):
+        raise RuntimeError(event.Path.name)
+
+    with watcher:
+        events = []
+        watcher.subscribe(fail)
+        watcher.subscribe(events.append)
+        unchanged = watcher.Corpus["GhostTools"].Files[0]
+        assert watcher.poll() == []
+
+        (tmp_path / "GhostTools" / "GhostTools.toc").write_text(source + "Extra.lua\n", encoding="utf-8")
+        (tmp_path / "GhostTools" / "GhostTools_Vanilla.toc").write_text(source, encoding="utf-8")
+        (tmp_path / "GhostTools" / "Notes.txt").write_text("not a toc file", encoding="utf-8")
+        (tmp_path / "Removed" / "Removed.toc").unlink()
+
+        changes = watcher.poll(timeout=1)
+        assert changes == events
+        assert str(watcher.LastError) == "Removed.toc"
+        assert [record.exc_info[0] for record in caplog.records] == [RuntimeError] * 3
+        assert [(e.Kind, e.Path.name) for e in changes] == [
+            (TOCChangeKind.Changed, "GhostTools.toc"),
+            (TOCChangeKind.Added, "GhostTools_Vanilla.toc"),
+            (TOCChangeKind.Removed, "Removed.toc"),
+        ]
+
+        changed = changes[0]
+        assert changed.Old is unchanged
+        assert changed.NewTOC.Files[-1].FileEntry.RawFilePath == "Extra.lua"
+        assert changed.OldTOC.Files[-1].FileEntry.RawFilePath != "Extra.lua"
+        assert changes[1].New.GameType == TOCGameType.Vanilla
+        assert changes[2].NewTOC is None
+
+        assert sorted(addon.Name for addon in watcher.Corpus) == ["GhostTools"]
+        assert watcher.Corpus["GhostTools"].get_toc(TOCGameType.Vanilla) is changes[1].NewTOC
+        assert watcher.poll(timeout=0.1) == []
+
+        if watcher.UsingInotify:
+            # a poll waiting on inotify doesn't hold the lock, so other polls aren't held up by it
+            waiting = threading.Thread(target=watcher.poll, kwargs={"timeout": 5})
+            waiting.start()
+            start = time.perf_counter()
+            assert watcher.poll() == []
+            assert time.perf_counter() - start < 1
+
+            (tmp_path / "GhostTools" / "GhostTools.toc").write_text(source, encoding="utf-8")
+            waiting.join()
+            assert (events[-1].Kind, events[-1].Path.name) == (TOCChangeKind.Changed, "GhostTools.toc")
+
+
 EXPORT_PATH = WORKING_DIRECTORY / "test_output.toc"
 
 